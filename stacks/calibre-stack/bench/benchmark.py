@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Converter benchmark - runs converter.py end to end against synthetic Calibre libraries
+Calibre itself is replaced by the stub tools in stubs/, so runs are offline and reproducible
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic_library import generate
+
+BENCH_DIR = Path(__file__).resolve().parent
+STUBS_DIR = BENCH_DIR / "stubs"
+CONVERTER = BENCH_DIR.parent / "converter.py"
+DEFAULT_SIZES = [1000, 10000, 100000]
+SUMMARY_FIELDS = ("Converted", "Skipped", "Errors")
+# Stub conversion time multipliers for the ebook-convert options of converter.py's CONVERSION_PROFILES.
+# Assumptions, not measurements: they only give the profiles some difference in cost. Comparisons
+# of profiles mean something once --option-cost carries ratios measured with real Calibre
+DEFAULT_OPTION_COST = {
+    "--enable-heuristics": 1.6,  # rescans every paragraph for unwrapping, scene breaks, italics
+    "--smarten-punctuation": 1.05,
+    "--chapter": 0.9,  # "/" disables the XPath chapter search
+    "--page-breaks-before": 0.97,
+    "--max-toc-links": 0.98,
+    "--no-chapters-in-toc": 0.98,
+    "--disable-font-size-rescaling": 0.9,
+    "--disable-remove-fake-margins": 0.95,
+}
+
+def parse_option_cost(value):
+    """{option: multiplier} from "--enable-heuristics=1.6,--chapter=0.9"; an empty string models none"""
+    cost = {}
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        option, _, multiplier = part.partition("=")
+        cost[option] = float(multiplier)
+    return cost
+
+def parse_sizes(value):
+    sizes = []
+    for part in value.split(","):
+        part = part.strip().lower()
+        scale = 1000 if part.endswith("k") else 1
+        sizes.append(int(part.rstrip("k")) * scale)
+    return sizes
+
+def run_converter(library, workdir, args, label, profile=None):
+    """Run one converter pass in a child process and measure it"""
+    call_log = workdir / f"{label}.calls"
+    output = workdir / f"{label}.log"
+    call_log.unlink(missing_ok=True)
+    env = dict(
+        os.environ,
+        PATH=f"{STUBS_DIR}{os.pathsep}{os.environ.get('PATH', '')}",
+        PYTHONUNBUFFERED="1",
+        BENCH_CALL_LOG=str(call_log),
+        BENCH_STARTUP_LATENCY=str(args.startup_latency),
+        BENCH_CONVERT_LATENCY=str(args.convert_latency),
+        BENCH_CALIBREDB_LATENCY=str(args.calibredb_latency),
+        BENCH_OPTION_COST=",".join(f"{option}={multiplier}" for option, multiplier in args.option_cost.items()),
+    )
+    # Host backpressure would measure the benchmark machine, not the converter; arguments after -- can turn it back on
+    cmd = [
+        sys.executable, str(CONVERTER), "--library", str(library), "--jobs", str(args.jobs),
+        "--max-cpu-pressure", "0", "--max-io-pressure", "0", "--max-load", "0",
+        # Libraries are generated from the same seed: a cache shared between them would reuse every conversion
+        "--cache-dir", str(library / ".converter" / "cache"),
+    ] + (["--conversion-profile", profile] if profile else []) + args.converter_args
+
+    start = time.monotonic()
+    with open(output, "w") as log:
+        process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        # wait4 gives the rusage of this pass alone; ru_maxrss covers the converter and every waited-for descendant
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.monotonic() - start
+
+    calls = collections.Counter()
+    if call_log.exists():
+        calls.update(line.strip() for line in call_log.read_text().splitlines() if line.strip())
+    summary = {}
+    text = output.read_text()
+    for name in SUMMARY_FIELDS:
+        match = re.search(rf"^\s+{name}: (\d+)", text, re.MULTILINE)
+        summary[name.lower()] = int(match.group(1)) if match else None
+
+    return {
+        "pass": label,
+        "exit_code": process.returncode,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),  # Linux reports KiB
+        # Warm-worker conversions and library API calls run in-process, so they are not subprocesses
+        "subprocesses": sum(n for tool, n in calls.items() if tool in ("calibredb", "ebook-convert", "calibre-debug")),
+        "calls": dict(sorted(calls.items())),
+        "log": str(output),
+        **summary,
+    }
+
+def benchmark_size(books, workdir, args, profile=None):
+    name = f"{books}-{profile}" if profile else str(books)
+    library = workdir / f"library-{name}"
+    if library.exists():
+        shutil.rmtree(library)
+    start = time.monotonic()
+    generate(str(library), books, args.seed, args.file_size)
+    generated = time.monotonic() - start
+    suffix = f", --conversion-profile {profile}" if profile else ""
+    print(f"📚 {books} books generated in {generated:.1f}s{suffix}")
+
+    results = []
+    for label in ["full", "incremental"][:args.passes]:
+        result = run_converter(library, workdir, args, f"{name}-{label}", profile)
+        result["books"] = books
+        result["profile"] = profile
+        results.append(result)
+        print(
+            f"   {label:<12} {result['wall_seconds']:>9.1f}s wall  {result['cpu_seconds']:>8.1f}s cpu  "
+            f"{result['subprocesses']:>7} subprocesses  {result['peak_rss_mb']:>7.1f} MB peak RSS  "
+            f"converted={result['converted']} errors={result['errors']}"
+        )
+        if result["exit_code"]:
+            print(f"   ⚠️  converter exited with {result['exit_code']}, see {result['log']}")
+
+    if not args.keep:
+        shutil.rmtree(library)
+    return results
+
+def compare_profiles(results):
+    """Print full-pass throughput per conversion profile, relative to the first one listed"""
+    print("-" * 50)
+    for books in sorted({result["books"] for result in results}):
+        full = [r for r in results if r["books"] == books and r["pass"].endswith("-full") and r["converted"]]
+        if not full:
+            continue
+        print(f"⚖️  {books} books, full pass:")
+        baseline = full[0]["converted"] / full[0]["wall_seconds"]
+        for result in full:
+            rate = result["converted"] / result["wall_seconds"]
+            print(f"   {result['profile']:<10} {rate * 60:>9.1f} books/min  {rate / baseline:>5.2f}x "
+                  f"{full[0]['profile']}  {result['subprocesses']:>7} subprocesses")
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", str(BENCH_DIR), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark converter.py against synthetic Calibre libraries",
+        epilog="Arguments after -- are passed to converter.py, e.g. -- --warm-workers --register-batch 50"
+    )
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES,
+                        help="Comma-separated library sizes, k suffix allowed (default: 1k,10k,100k)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Converter workers (default: CPU count)")
+    parser.add_argument("--passes", type=int, choices=[1, 2], default=2,
+                        help="1 = full conversion only, 2 = also time an unchanged incremental re-run (default: 2)")
+    parser.add_argument("--startup-latency", type=float, default=0.05,
+                        help="Seconds each stub Calibre process spends starting up (default: 0.05)")
+    parser.add_argument("--convert-latency", type=float, default=0.01,
+                        help="Seconds per stub conversion (default: 0.01)")
+    parser.add_argument("--calibredb-latency", type=float, default=0.005,
+                        help="Seconds per stub library operation (default: 0.005)")
+    parser.add_argument("--option-cost", type=parse_option_cost, default=DEFAULT_OPTION_COST,
+                        help="Stub conversion time multiplier per ebook-convert option, e.g. "
+                             "--enable-heuristics=1.6,--chapter=0.9; empty for none (default: assumed, "
+                             "unmeasured multipliers for the conversion profiles' options)")
+    parser.add_argument("--file-size", type=int, default=4096,
+                        help="Average synthetic source file size in bytes (default: 4096)")
+    parser.add_argument("--profiles", type=lambda value: [p.strip() for p in value.split(",") if p.strip()],
+                        help="Comma-separated --conversion-profile values to compare on identical libraries, "
+                             "e.g. balanced,fast,quality")
+    parser.add_argument("--seed", type=int, default=1, help="Library generator seed (default: 1)")
+    parser.add_argument("--workdir", type=Path,
+                        help="Directory for libraries and logs (default: a new temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep generated libraries after each size")
+    parser.add_argument("--json", type=Path, help="Append results as one JSON line to this file")
+    parser.add_argument("converter_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.converter_args[:1] == ["--"]:
+        args.converter_args = args.converter_args[1:]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="converter-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    print("⏱️  Converter benchmark")
+    print(f"Workdir: {workdir}")
+    print(f"Workers: {args.jobs}  Converter args: {' '.join(args.converter_args) or '(none)'}")
+    print(f"Latency: startup {args.startup_latency}s, convert {args.convert_latency}s, "
+          f"library {args.calibredb_latency}s")
+    if args.profiles:
+        assumed = " (assumed, pass measured ratios with --option-cost)" if args.option_cost is DEFAULT_OPTION_COST else ""
+        print(f"Option cost{assumed}: {', '.join(f'{o} x{m}' for o, m in args.option_cost.items()) or '(none)'}")
+    print("-" * 50)
+
+    results = []
+    for books in args.sizes:
+        for profile in args.profiles or [None]:
+            results.extend(benchmark_size(books, workdir, args, profile))
+    if args.profiles:
+        compare_profiles(results)
+
+    if args.json:
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "jobs": args.jobs,
+            "converter_args": args.converter_args,
+            "profiles": args.profiles,
+            "latency": {
+                "startup": args.startup_latency,
+                "convert": args.convert_latency,
+                "calibredb": args.calibredb_latency,
+            },
+            "option_cost": args.option_cost,
+            "results": results,
+        }
+        with open(args.json, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"📝 Results appended to {args.json}")
+
+    return 1 if any(r["exit_code"] for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Shared helpers for the stub Calibre tools used by the converter benchmark
+Latencies come from environment variables set by benchmark.py
+"""
+
+import os
+import shutil
+import sqlite3
+import time
+
+def log_call(tool):
+    """Count a process launch (or in-process call) in the benchmark call log"""
+    path = os.environ.get("BENCH_CALL_LOG")
+    if path:
+        with open(path, "a") as f:
+            f.write(tool + "\n")
+
+def sleep(variable):
+    time.sleep(float(os.environ.get(variable, "0")))
+
+def startup(tool):
+    """Pretend to load Calibre's interpreter and plugins"""
+    log_call(tool)
+    sleep("BENCH_STARTUP_LATENCY")
+
+def option_cost(options):
+    """Conversion time multiplier for ebook-convert options, from BENCH_OPTION_COST ("--option=multiplier,...")"""
+    cost = dict(part.split("=", 1) for part in os.environ.get("BENCH_OPTION_COST", "").split(",") if part)
+    multiplier = 1.0
+    for option in options:
+        multiplier *= float(cost.get(option, 1))
+    return multiplier
+
+def convert(source, output, options=()):
+    """Fake conversion: copy the source after the configured delay, scaled for its options"""
+    fmt = os.path.splitext(output)[1].lstrip(".").lower()
+    if fmt in os.environ.get("BENCH_UNSUPPORTED_OUTPUTS", "").split(","):
+        # What Calibre says when an output plugin (e.g. KePub Output) is not installed
+        raise ValueError(f"No plugin to handle output format: {fmt}")
+    # Progress lines as Calibre logs them (flushed as it goes), with the delay spread over the stages
+    latency = float(os.environ.get("BENCH_CONVERT_LATENCY", "0")) * option_cost(options)
+    print("1% Converting input to HTML...", flush=True)
+    time.sleep(latency * 0.4)
+    print("34% Running transforms on e-book...", flush=True)
+    time.sleep(latency * 0.3)
+    print(f"Creating {fmt.upper()} Output...", flush=True)
+    print(f"67% Running {fmt.upper()} Output plugin", flush=True)
+    time.sleep(latency * 0.3)
+    shutil.copyfile(source, output)
+    print(f"{fmt.upper()} output written to {output}")
+    print(f"Output saved to   {output}", flush=True)
+    return 0
+
+def add_format(library, book_id, fmt, source):
+    """Register a format the way Calibre does: copy into the book folder and update metadata.db"""
+    sleep("BENCH_CALIBREDB_LATENCY")
+    db = sqlite3.connect(os.path.join(library, "metadata.db"), timeout=60)
+    try:
+        row = db.execute("SELECT path, title FROM books WHERE id = ?", (book_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"No book with id {book_id}")
+        name = db.execute("SELECT name FROM data WHERE book = ? LIMIT 1", (book_id,)).fetchone()
+        name = name[0] if name else row[1]
+        dest = os.path.join(library, row[0], f"{name}.{fmt.lower()}")
+        if not os.path.exists(dest) or not os.path.samefile(source, dest):
+            shutil.copyfile(source, dest)
+        db.execute(
+            "INSERT OR REPLACE INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)",
+            (book_id, fmt.upper(), os.path.getsize(dest), name)
+        )
+        db.execute(
+            "UPDATE books SET last_modified = ? WHERE id = ?",
+            (time.strftime("%Y-%m-%d %H:%M:%S.000000+00:00", time.gmtime()), book_id)
+        )
+        db.commit()
+        return True
+    finally:
+        db.close()
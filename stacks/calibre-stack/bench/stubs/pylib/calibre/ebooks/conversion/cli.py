@@ -0,0 +1,7 @@
+"""Fake calibre.ebooks.conversion.cli for warm conversion workers"""
+
+import _stub
+
+def main(args):
+    _stub.log_call("warm-convert")
+    return _stub.convert(args[1], args[2], args[3:])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Synthetic Calibre library generator for the converter benchmark
+Builds a metadata.db with Calibre's books/data/authors layout and small source files on disk
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+
+# Rough format mix of a homelab library grown from old Kindle/Mobipocket collections
+FORMAT_MIX = [("epub", 35), ("mobi", 25), ("azw3", 12), ("pdf", 10), ("azw", 5), ("txt", 6), ("djvu", 4), ("rtf", 3)]
+EXTRA_FORMAT_CHANCE = 0.15  # Books carrying a second format
+DUPLICATE_CHANCE = 0.03  # Same file imported twice under different records
+AUTHORS = 2000
+
+SCHEMA = """
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL DEFAULT 'Unknown',
+    sort TEXT,
+    timestamp TIMESTAMP,
+    pubdate TIMESTAMP,
+    series_index REAL NOT NULL DEFAULT 1.0,
+    author_sort TEXT,
+    isbn TEXT DEFAULT '',
+    lccn TEXT DEFAULT '',
+    path TEXT NOT NULL DEFAULT '',
+    flags INTEGER NOT NULL DEFAULT 1,
+    uuid TEXT,
+    has_cover BOOL DEFAULT 0,
+    last_modified TIMESTAMP NOT NULL DEFAULT '2000-01-01 00:00:00+00:00'
+);
+CREATE TABLE data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book INTEGER NOT NULL,
+    format TEXT NOT NULL COLLATE NOCASE,
+    uncompressed_size INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE(book, format)
+);
+CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT, link TEXT NOT NULL DEFAULT '');
+CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, author INTEGER NOT NULL, UNIQUE(book, author));
+CREATE INDEX data_idx ON data (book);
+CREATE INDEX books_authors_link_bidx ON books_authors_link (book);
+"""
+
+RTF_BODY = "{{\\rtf1\\ansi{{\\fonttbl\\f0 Times;}}\\f0 {title}\\par {text}\\par}}"
+
+def source_body(rnd, book_id, fmt, size):
+    """Small deterministic file contents; the stub tools never parse them"""
+    text = f"Chapter {book_id}. Synthetic {fmt} content for benchmark runs. "
+    text = (text * (size // len(text) + 1))[:size]
+    if fmt == "rtf":
+        return RTF_BODY.format(title=f"Book {book_id}", text=text).encode()
+    return text.encode()
+
+def generate(root, books, seed=1, file_size=4096):
+    """Create a library with `books` books under `root` (which must not exist yet)"""
+    os.makedirs(root)
+    rnd = random.Random(seed)
+    weighted = [fmt for fmt, weight in FORMAT_MIX for _ in range(weight)]
+    db = sqlite3.connect(os.path.join(root, "metadata.db"))
+    db.executescript(SCHEMA)
+    db.executemany(
+        "INSERT INTO authors (id, name, sort) VALUES (?, ?, ?)",
+        [(i, f"Author {i}", f"{i}, Author") for i in range(1, AUTHORS + 1)]
+    )
+
+    previous = None
+    for book_id in range(1, books + 1):
+        author = rnd.randint(1, AUTHORS)
+        title = f"Book {book_id}"
+        path = f"Author {author}/{title} ({book_id})"
+        name = f"{title} - Author {author}"
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_600_000_000 + book_id * 60))
+        db.execute(
+            "INSERT INTO books (id, title, sort, timestamp, author_sort, path, uuid, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (book_id, title, title, stamp, f"{author}, Author", path, str(uuid.UUID(int=rnd.getrandbits(128))),
+             stamp + ".000000+00:00")
+        )
+        db.execute("INSERT INTO books_authors_link (book, author) VALUES (?, ?)", (book_id, author))
+
+        formats = {rnd.choice(weighted)}
+        if rnd.random() < EXTRA_FORMAT_CHANCE:
+            formats.add(rnd.choice(weighted))
+        os.makedirs(os.path.join(root, path))
+        for fmt in sorted(formats):
+            if previous and previous[0] == fmt and rnd.random() < DUPLICATE_CHANCE:
+                body = previous[1]
+            else:
+                body = source_body(rnd, book_id, fmt, rnd.randint(file_size // 4, file_size * 2))
+            with open(os.path.join(root, path, f"{name}.{fmt}"), "wb") as f:
+                f.write(body)
+            db.execute(
+                "INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)",
+                (book_id, fmt.upper(), len(body), name)
+            )
+            previous = (fmt, body)
+    db.commit()
+    db.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Calibre library")
+    parser.add_argument("root", help="Library directory to create")
+    parser.add_argument("books", type=int, help="Number of books")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--file-size", type=int, default=4096, help="Average source file size in bytes (default: 4096)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if os.path.exists(args.root):
+        print(f"❌ {args.root} already exists", file=sys.stderr)
+        return 1
+    start = time.time()
+    generate(args.root, args.books, args.seed, args.file_size)
+    print(f"✅ Generated {args.books} books in {args.root} ({time.time() - start:.1f}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,164 +4,4049 @@ Calibre Library Converter - Converts all books to EPUB format
 Run daily to ensure all books have EPUB format available
 """
 
+import argparse
+import base64
+import codecs
+import collections
+import contextlib
+import csv
+import ctypes
+import ctypes.util
+import datetime
+import fcntl
+import hashlib
+import heapq
+import html
+import http.client
+import itertools
+import math
+import mmap
+import os
+import queue
+import re
+import select
+import signal
+import socket
+import struct
 import subprocess
 import json
+import sqlite3
+import shutil
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 # Configuration
 CALIBRE_LIBRARY = "/calibre-library"
 CONVERT_FROM = ["mobi", "azw3", "azw", "djvu", "txt", "rtf"]  # PDF excluded - poor conversion quality
-CONVERT_TO = "epub"
+CONVERT_TO = "epub"  # default target; --targets adds more (e.g. azw3 for Kindles, kepub for Kobos)
+DERIVE_FROM = "epub"  # further targets are converted from this format instead of decoding the source again
+UNSUPPORTED_OUTPUT = "No plugin to handle output format"  # e.g. kepub without the KePub Output plugin
+BUILTIN_OUTPUTS = {
+    "azw3", "docx", "epub", "fb2", "htmlz", "lit", "lrf", "mobi", "oeb", "pdb", "pdf", "pml", "rb", "rtf",
+    "snb", "tcr", "txt", "txtz", "zip",
+}
+STATE_DIR_NAME = ".converter"  # Kept inside the library, like Calibre's own .caltrash
+SCRATCH_PREFIX = "converter-scratch-"  # per-run scratch directories under --scratch-dir
+PUBLISHING_DIR_NAME = "publishing"  # state dir markers for files being placed in book folders
+JOURNAL_NAME = "journal.jsonl"  # state dir log of the current pass, replayed after a crash
 
-def run_command(cmd):
-    """Run a shell command and return output"""
+# Watch mode: every import rewrites metadata.db, so that is the only file we need to watch
+WATCH_FILES = ("metadata.db", "metadata.db-journal", "metadata.db-wal")
+DEFAULT_DEBOUNCE = 5  # seconds of quiet before a batch is converted
+DEFAULT_MAX_BATCH_DELAY = 60  # never hold a batch back longer than this during a bulk import
+DEFAULT_POLL_INTERVAL = 30  # used when inotify is unavailable (e.g. NFS-backed library)
+
+# Warm workers: recycle each calibre-debug process after this many books to bound leaks
+WARM_WORKER_MAX_JOBS = 50
+WARM_WORKER_STARTUP = 30  # extra seconds allowed for the first job while Calibre loads
+
+# Converted files are registered in batches by a single writer to keep library lock time short
+DEFAULT_REGISTER_BATCH = 25
+REGISTER_MAX_DELAY = 30  # seconds a converted book may wait for its batch
+REGISTER_LOCK_RETRIES = 5  # attempts per book when metadata.db is locked by calibre-web
+
+# Conversion cache: identical source files (same content hash) are converted once
+DEFAULT_CACHE_SIZE_MB = 2048
+CACHE_DIR_NAME = "converter-cache"  # default cache directory, beside the scratch directories
+CACHE_FILESYSTEM_SHARE = 0.25  # most of its filesystem the cache may take, so it cannot crowd out scratch
+HASH_CHUNK_SIZE = 16 * 1024 * 1024  # files larger than this are hashed chunk by chunk in parallel
+
+# Conversion profiles (--conversion-profile): extra ebook-convert options per source format,
+# "*" for the others, or NATIVE_BUILD where build_epub() writes the EPUB in-process
+NATIVE_BUILD = "native"
+SKIP_DETECTION = [  # structure detection and look & feel passes a bulk backfill can do without
+    "--chapter", "/", "--page-breaks-before", "/", "--max-toc-links", "0", "--no-chapters-in-toc",
+    "--disable-font-size-rescaling", "--disable-remove-fake-margins",
+]
+CONVERSION_PROFILES = {
+    "fast": {"*": SKIP_DETECTION, "txt": NATIVE_BUILD, "rtf": NATIVE_BUILD},
+    "balanced": {"*": [], "txt": NATIVE_BUILD, "rtf": NATIVE_BUILD},  # Calibre's defaults
+    # Heuristic processing repairs badly formatted sources, TXT and RTF included; our own EPUB needs none
+    "quality": {"*": ["--enable-heuristics", "--smarten-punctuation"], "epub": []},
+}
+DEFAULT_PROFILE = "balanced"
+
+# Scheduling: rough seconds of conversion per (MB of source + 1), replaced by
+# the measured rate once a format has MIN_COST_SAMPLES conversions in the state store.
+# TXT and RTF are mostly built in-process (build_epub), so they cost next to nothing
+FORMAT_COST = {"epub": 2, "txt": 0.05, "rtf": 0.5, "mobi": 4, "azw3": 4, "azw": 4, "djvu": 25}
+DEFAULT_FORMAT_COST = 5
+MIN_COST_SAMPLES = 5
+
+# Discovery runs on its own thread and feeds the dispatcher while earlier books convert
+BOOK_PAGE = 500  # books per read of metadata.db, so Calibre is never locked out for long
+DISCOVERY_WINDOW = 1000  # jobs sorted cheapest first together; the dispatcher gets smaller windows while idle
+DISCOVERY_QUEUE = 2  # windows waiting for the dispatcher before discovery pauses
+
+# Calibre content server backend (--with-library)
+MSGPACK_MIME = "application/x-msgpack"
+SERVER_TIMEOUT = 300
+SERVER_ID_CHUNK = 100  # book IDs per search sent to the server
+
+# Timeouts scale with the cost estimate and double each time a book has timed out before
+TIMEOUT_COST_FACTOR = 5
+MIN_TIMEOUT = 120
+MAX_TIMEOUT = 4 * 3600
+TIMEOUT_MESSAGE = "Command timed out"
+
+# Failed books are retried on later runs after 1h, 2h, 4h, ...; then quarantined
+RETRY_BACKOFF = 3600
+MAX_ATTEMPTS = 5
+
+# Prometheus metrics: /metrics over HTTP in watch mode, or a node-exporter textfile in batch mode
+DEFAULT_METRICS_PORT = 9465
+METRICS_TEXTFILE_INTERVAL = 15  # seconds between textfile rewrites during a run
+THROUGHPUT_WINDOW = 300  # seconds of completed books behind converter_books_per_minute
+STATUS_FILE_INTERVAL = 5  # seconds between --status-file rewrites during a run
+
+# Profiling (--profile-dir): the progress lines Calibre prints as each conversion stage starts
+STAGE_MARKERS = (
+    ("input", re.compile(r"\d+% Converting input")),
+    ("transforms", re.compile(r"\d+% Running transforms")),
+    ("output", re.compile(r"Creating \S+ Output|\d+% Running \S+ Output plugin")),
+    (None, re.compile(r"Output saved to")),
+)
+STAGES = ("startup", "input", "transforms", "output")
+PROFILE_TOP = 20  # slowest conversions listed in the report
+
+# Distributed mode: the coordinator queues jobs in Redis, workers on other nodes convert them
+REDIS_PREFIX = "converter"
+REDIS_KEY_TTL = 24 * 3600  # jobs, files and results left behind by crashed processes expire
+LEASE_SECONDS = 60  # a job whose worker sends no heartbeat for this long is requeued
+HEARTBEAT_INTERVAL = 15
+MAX_REQUEUES = 3  # then the book fails like any other conversion error
+MAX_REMOTE_SOURCE = 128 * 1024 * 1024  # larger sources are converted on the coordinator
+REMOTE_BYTES_IN_FLIGHT = 256 * 1024 * 1024  # source bytes stored in Redis at any time
+
+# Resource limits: the default worker count and the memory headroom come from the container's cgroup v2
+CGROUP_ROOT = "/sys/fs/cgroup"
+JOB_MEMORY = 400 * 1024 * 1024  # assumed peak memory of one conversion until real ones have been measured
+MIN_MEMORY_SAMPLES = 30  # samples (one per second of conversions) before the measured peak replaces it
+MEMORY_HEADROOM = 0.85  # share of the memory limit in use above which new conversions wait
+
+# Backpressure: conversions yield to other services on the node (Jellyfin transcodes) while it is busy
+PSI_FILES = {"cpu": "/proc/pressure/cpu", "io": "/proc/pressure/io"}
+DEFAULT_MAX_CPU_PRESSURE = 40  # PSI "some avg10": % of the last 10s some task waited for CPU
+DEFAULT_MAX_IO_PRESSURE = 40
+DEFAULT_MAX_LOAD = 1.5  # 1-minute load average per CPU
+PRESSURE_STEP = 10  # seconds between changes of the concurrency limit
+QUIET_FACTOR = 0.5  # the limit only grows back while every reading is below this share of its threshold
+
+def run_command(cmd, timeout=300, input=None):
+    """Run a command (argument list, no shell) and return output"""
     try:
         result = subprocess.run(
             cmd,
-            shell=True,
+            input=input,
             capture_output=True,
             text=True,
-            timeout=300
+            timeout=timeout
         )
         return result.returncode == 0, result.stdout, result.stderr
     except subprocess.TimeoutExpired:
-        return False, "", "Command timed out"
+        return False, "", TIMEOUT_MESSAGE
     except Exception as e:
         return False, "", str(e)
 
-def get_all_books():
-    """Get all book IDs from library"""
-    success, stdout, stderr = run_command(f"calibredb list --library-path {CALIBRE_LIBRARY} --for-machine --fields id,formats")
+class Metric:
+    """A Prometheus metric family; values are kept per label set"""
+
+    def __init__(self, kind, name, documentation, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def labels_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{self.labels_text(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__("counter", name, documentation, labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A gauge set directly, or computed by `function` when scraped"""
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__("gauge", name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+class Histogram(Metric):
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__("histogram", name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{self.labels_text(key, [('le', str(bound))])} {bucket}")
+                lines.append(f"{self.name}_bucket{self.labels_text(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{self.labels_text(key)} {total}")
+                lines.append(f"{self.name}_count{self.labels_text(key)} {count}")
+        return lines
+
+METRICS = []
+COMPLETIONS = collections.deque()  # monotonic timestamps of recently finished books
+COMPLETIONS_LOCK = threading.Lock()  # metrics scrapes trim COMPLETIONS from the HTTP server's threads
+
+def book_completed():
+    with COMPLETIONS_LOCK:
+        COMPLETIONS.append(time.monotonic())
+
+def books_per_minute():
+    cutoff = time.monotonic() - THROUGHPUT_WINDOW
+    with COMPLETIONS_LOCK:
+        while COMPLETIONS and COMPLETIONS[0] < cutoff:
+            COMPLETIONS.popleft()
+        return len(COMPLETIONS) * 60 / THROUGHPUT_WINDOW
+
+CONVERSION_SECONDS = Histogram(
+    "converter_conversion_duration_seconds", "Time spent converting one book, by source format",
+    ("format",), (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+CALIBREDB_SECONDS = Histogram(
+    "converter_calibredb_duration_seconds",
+    "Latency of calls into calibredb / the Calibre library API or content server",
+    ("command",), (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300)
+)
+BOOKS_TOTAL = Counter("converter_books_total", "Books processed, by outcome", ("result",))
+TIMEOUTS_TOTAL = Counter("converter_timeouts_total", "Conversions killed by their timeout", ("format",))
+BOOKS_PER_MINUTE = Gauge(
+    "converter_books_per_minute", f"Books finished per minute over the last {THROUGHPUT_WINDOW}s",
+    function=books_per_minute
+)
+QUEUE_DEPTH = Gauge("converter_queue_depth", "Books waiting to be converted in the current pass")
+RUNNING_JOBS = Gauge("converter_running_jobs", "Conversions in progress")
+LAST_RUN_TIMESTAMP = Gauge("converter_last_run_timestamp_seconds", "Unix time the last pass finished")
+LAST_RUN_DURATION = Gauge("converter_last_run_duration_seconds", "Duration of the last pass")
+MEMORY_USAGE = Gauge("converter_memory_bytes", "Memory in use by the container (or process tree) of the converter")
+MEMORY_LIMIT = Gauge("converter_memory_limit_bytes", "Memory limit the converter schedules conversions against")
+JOB_MEMORY_BYTES = Gauge("converter_job_memory_bytes", "Peak memory assumed for one conversion")
+MEMORY_HELD_SECONDS = Counter(
+    "converter_memory_held_seconds_total", "Time new conversions waited for memory to become available"
+)
+HOST_PRESSURE = Gauge(
+    "converter_host_pressure", "Host CPU/IO pressure (PSI some avg10, %) and load average per CPU", ("resource",)
+)
+DISPATCH_LIMIT = Gauge("converter_dispatch_limit", "Conversions allowed to run given the host's pressure")
+PAUSED_SECONDS = Counter("converter_paused_seconds_total", "Time new conversions were paused for host pressure")
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def write_metrics_textfile(path):
+    """Atomically rewrite a node-exporter textfile collector file"""
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, "w") as f:
+            f.write(render_metrics())
+        os.replace(temp, path)
+    except OSError as e:
+        print(f"⚠️  Cannot write metrics to {path}: {e}")
+
+def utc_timestamp(seconds=None):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+class Progress:
+    """Live progress of the current pass, for /status and --status-file
+
+    Books are tracked from the moment a worker takes them until their outcome is
+    reported: converting, then registering while they wait for the Registrar.
+    Throughput is measured over the last THROUGHPUT_WINDOW seconds of this pass
+    only, so the ETA neither starts at zero nor carries over an earlier pass.
+    While discovery is still finding books the remaining count (and the ETA) is
+    a lower bound.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = "starting"
+        self.started = None  # monotonic and wall clock start of the pass
+        self.started_at = None
+        self.workers = 0
+        self.mode = None
+        self.counts = {}
+        self.current = {}  # key -> details of a book being converted
+        self.registering = set()
+        self.queued = 0
+        self.discovering = False
+        self.finished = collections.deque()  # monotonic timestamps of books finished in this pass
+        self.last_pass = None
+
+    def begin(self, workers, mode, state="converting"):
+        with self.lock:
+            self.state = state
+            self.started = time.monotonic()
+            self.started_at = time.time()
+            self.workers = workers
+            self.mode = mode
+            self.counts = {}
+            self.current.clear()
+            self.registering.clear()
+            self.queued = 0
+            self.discovering = mode is not None
+            self.finished.clear()
+
+    def waiting(self, queued, discovering):
+        with self.lock:
+            self.queued = queued
+            self.discovering = discovering
+
+    def converting(self, key, **details):
+        with self.lock:
+            self.current[key] = {**details, "started": time.monotonic()}
+
+    def converted(self, key):
+        """Conversion done, waiting to be added to the library"""
+        with self.lock:
+            self.current.pop(key, None)
+            self.registering.add(key)
+
+    def done(self, key, result, counted=True):
+        """A book's outcome; `counted` books make up the throughput (not those carried over)"""
+        with self.lock:
+            self.current.pop(key, None)
+            self.registering.discard(key)
+            self.counts[result] = self.counts.get(result, 0) + 1
+            if counted:
+                self.finished.append(time.monotonic())
+
+    def end(self, **summary):
+        with self.lock:
+            self.state = "idle"
+            self.last_pass = {
+                "started": utc_timestamp(self.started_at),
+                "finished": utc_timestamp(),
+                "duration_seconds": round(time.monotonic() - self.started, 1),
+                **self.counts, **summary,
+            }
+            self.current.clear()
+            self.registering.clear()
+            self.queued = 0
+            self.discovering = False
+
+    def snapshot(self):
+        """The status document served on /status"""
+        now = time.monotonic()
+        with self.lock:
+            status = {"state": self.state, "updated": utc_timestamp()}
+            if self.state != "idle" and self.started is not None:
+                elapsed = now - self.started
+                while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+                    self.finished.popleft()
+                window = min(elapsed, THROUGHPUT_WINDOW)
+                rate = len(self.finished) / window if window >= 1 else 0.0
+                remaining = self.queued + len(self.current) + len(self.registering)
+                eta = remaining / rate if rate and self.mode is not None else None
+                status["pass"] = {
+                    "mode": self.mode,
+                    "started": utc_timestamp(self.started_at),
+                    "elapsed_seconds": round(elapsed, 1),
+                    "workers": self.workers,
+                }
+                status["done"] = {"total": sum(self.counts.values()), **self.counts}
+                if self.mode is not None:
+                    status["remaining"] = {
+                        "total": remaining,
+                        "queued": self.queued,
+                        "converting": len(self.current),
+                        "registering": len(self.registering),
+                        "complete": not self.discovering,  # False while more books may still be found
+                    }
+                status["current"] = [
+                    {**{k: v for k, v in details.items() if k != "started"},
+                     "seconds": round(now - details["started"], 1)}
+                    for details in sorted(self.current.values(), key=lambda details: details["started"])
+                ]
+                status["books_per_minute"] = round(rate * 60, 2)
+                status["eta_seconds"] = round(eta) if eta is not None else None
+                status["eta"] = utc_timestamp(time.time() + eta) if eta is not None else None
+            if self.last_pass is not None:
+                status["last_pass"] = self.last_pass
+        return status
+
+PROGRESS = Progress()
+
+def write_status_file(path):
+    """Atomically rewrite the --status-file JSON"""
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, "w") as f:
+            json.dump(PROGRESS.snapshot(), f, indent=1)
+        os.replace(temp, path)
+    except OSError as e:
+        print(f"⚠️  Cannot write status to {path}: {e}")
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = render_metrics().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/status":
+            body = json.dumps(PROGRESS.snapshot(), indent=1).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        if path == "/status":
+            self.send_header("Access-Control-Allow-Origin", "*")  # for dashboards fetching it from the browser
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port):
+    """Serve /metrics and /status from a background thread"""
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 Metrics on http://0.0.0.0:{port}/metrics, progress on /status")
+    return server
+
+@dataclass
+class Book:
+    """A library entry with the on-disk path of each of its formats"""
+    id: int
+    path: str
+    formats: dict = field(default_factory=dict)  # lowercase format -> absolute file path
+    sizes: dict = field(default_factory=dict)  # lowercase format -> size in bytes
+    last_modified: str = ""
+
+def open_metadata_db(library=CALIBRE_LIBRARY):
+    """Open the library's metadata.db read-only so we never take Calibre's write lock"""
+    uri = Path(library, "metadata.db").resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=30)
+
+def read_books_from_db(library=CALIBRE_LIBRARY, since=None, ids=None):
+    """Read books with their formats and file paths in a single query
+
+    Returns every book, or only those modified after `since`, or only `ids`.
+    """
+    conn = open_metadata_db(library)
+    try:
+        if ids is not None:
+            ids = sorted(ids)
+            where, params = f"WHERE books.id IN ({','.join('?' * len(ids))}) ", ids
+        elif since:
+            where, params = "WHERE books.last_modified >= ? ", (since,)
+        else:
+            where, params = "", ()
+        rows = conn.execute(
+            "SELECT books.id, books.path, books.last_modified, data.format, data.name, data.uncompressed_size "
+            "FROM books LEFT JOIN data ON data.book = books.id "
+            f"{where}ORDER BY books.id",
+            params
+        )
+        books = []
+        book = None
+        for book_id, book_path, last_modified, fmt, name, size in rows:
+            if book is None or book.id != book_id:
+                book = Book(book_id, book_path, last_modified=str(last_modified or ""))
+                books.append(book)
+            if fmt:
+                fmt = fmt.lower()
+                book.formats[fmt] = os.path.join(library, book_path, f"{name}.{fmt}")
+                book.sizes[fmt] = size or 0
+        return books
+    finally:
+        conn.close()
+
+def read_books_from_calibredb(library=CALIBRE_LIBRARY):
+    """List books through calibredb when metadata.db cannot be read directly"""
+    with CALIBREDB_SECONDS.time(command="list"):
+        success, stdout, stderr = run_command(
+            ["calibredb", "list", "--library-path", library, "--for-machine", "--fields", "id,formats"]
+        )
     if not success:
         print(f"Error listing books: {stderr}")
         return []
 
+    try:
+        entries = json.loads(stdout or "[]")
+    except json.JSONDecodeError:
+        print("Error listing books: failed to parse calibredb output")
+        return []
+
     books = []
-    for line in stdout.strip().split('\n'):
-        if line:
-            parts = line.split(',')
-            if len(parts) >= 2:
-                book_id = parts[0].strip()
-                formats = parts[1].strip() if len(parts) > 1 else ""
-                books.append((book_id, formats))
+    for entry in entries:
+        paths = entry.get("formats") or []
+        book_path = os.path.relpath(os.path.dirname(paths[0]), library) if paths else ""
+        book = Book(int(entry["id"]), book_path)
+        for path in paths:
+            fmt = Path(path).suffix.lstrip(".").lower()
+            book.formats[fmt] = path
+        books.append(book)
     return books
 
-def convert_book(book_id, source_format, target_format):
-    """Convert a book from one format to another"""
-    # Get the book info to find source file
-    success, stdout, stderr = run_command(
-        f"calibredb show {book_id} --library-path {CALIBRE_LIBRARY} --format json"
-    )
-    if not success:
-        return False, f"Failed to get book info: {stderr}"
+def msgpack_pack(value):
+    """Encode None, booleans, integers, strings, bytes and lists as MessagePack"""
+    if value is None:
+        return b"\xc0"
+    if isinstance(value, bool):
+        return b"\xc3" if value else b"\xc2"
+    if isinstance(value, int):
+        if -32 <= value < 128:
+            return struct.pack("b", value)
+        return b"\xd3" + struct.pack(">q", value)
+    if isinstance(value, str):
+        value = value.encode()
+        return b"\xdb" + struct.pack(">I", len(value)) + value
+    if isinstance(value, bytes):
+        return b"\xc6" + struct.pack(">I", len(value)) + value
+    if isinstance(value, (list, tuple)):
+        return b"\xdd" + struct.pack(">I", len(value)) + b"".join(msgpack_pack(item) for item in value)
+    raise TypeError(f"cannot encode {type(value).__name__} as MessagePack")
 
+def server_timestamp(value):
+    """A last_modified from the server in metadata.db's text form, so watermarks compare across backends"""
+    if isinstance(value, dict):
+        value = next((item for item in value.values() if isinstance(item, str)), None)
+    if not value:
+        return ""
     try:
-        book_data = json.loads(stdout)
-    except json.JSONDecodeError:
-        return False, "Failed to parse book info"
-
-    # Find source format path
-    source_path = None
-    if book_data and len(book_data) > 0:
-        book_info = book_data[0]
-        if 'format_metadata' in book_info:
-            for fmt in book_info['format_metadata']:
-                if fmt.lower() == source_format.lower():
-                    # Get the actual file path
-                    success, stdout, stderr = run_command(
-                        f"calibredb show {book_id} --library-path {CALIBRE_LIBRARY} "
-                        f"--fields '{source_format}:'{source_format}'' --for-machine"
-                    )
-                    if success and stdout.strip():
-                        source_path = stdout.strip().split(',')[-1]
+        return str(datetime.datetime.fromisoformat(value))
+    except ValueError:
+        return str(value)
+
+class CalibreServerError(Exception):
+    """Error reply from a Calibre content server, or a request it refused"""
+
+class CalibreServer:
+    """Client of a running Calibre content server's calibredb interface (/cdb/cmd)
+
+    Speaks the protocol of `calibredb --with-library http://...`: arguments go
+    out as MessagePack (files included), answers come back as JSON. The server
+    owns metadata.db, so listing books and adding formats through it never
+    fights calibre-web for the SQLite lock. Each thread keeps its own HTTP/1.1
+    connection open between calls. Adding formats needs calibre-server
+    --enable-local-write, or a user with write access.
+    """
+
+    def __init__(self, url, password=None, timeout=SERVER_TIMEOUT):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(
+                f"unsupported Calibre server URL {url!r} (use http://[user@]host:port[/prefix][#library_id])"
+            )
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.prefix = parsed.path.rstrip("/")  # calibre-server --url-prefix
+        self.library_id = urllib.parse.unquote(parsed.fragment) or None
+        self.username = urllib.parse.unquote(parsed.username) if parsed.username else None
+        self.password = password or (urllib.parse.unquote(parsed.password) if parsed.password else None)
+        self.url = f"{parsed.scheme}://{parsed.hostname}" + (f":{parsed.port}" if parsed.port else "") + self.prefix
+        if self.library_id:
+            self.url += f"/#{self.library_id}"
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.challenge = None  # (scheme, params) of the last WWW-Authenticate
+        self.nonce_count = 0
+
+    def post(self, path, body, headers):
+        """POST on this thread's connection: (status, WWW-Authenticate, body)"""
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            if conn is None:
+                conn = self.local.conn = self.connection_class(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request("POST", path, body, headers)
+                response = conn.getresponse()
+                return response.status, response.getheader("WWW-Authenticate", ""), response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                self.local.conn = None
+                # The server drops idle keep-alive connections; one retry on a fresh one
+                if attempt:
+                    raise CalibreServerError(f"{self.url}: {e}") from e
+
+    def authorization(self, method, path):
+        """Authorization header answering the last challenge, if any"""
+        if not self.username or self.challenge is None:
+            return {}
+        scheme, params = self.challenge
+        if scheme == "basic":
+            token = base64.b64encode(f"{self.username}:{self.password or ''}".encode()).decode()
+            return {"Authorization": f"Basic {token}"}
+
+        def md5(text):
+            return hashlib.md5(text.encode()).hexdigest()
+
+        with self.lock:
+            self.nonce_count += 1
+            nc = f"{self.nonce_count:08x}"
+        cnonce = uuid.uuid4().hex
+        realm, nonce = params.get("realm", ""), params.get("nonce", "")
+        ha1 = md5(f"{self.username}:{realm}:{self.password or ''}")
+        response = md5(f"{ha1}:{nonce}:{nc}:{cnonce}:auth:{md5(f'{method}:{path}')}")
+        header = (f'Digest username="{self.username}", realm="{realm}", nonce="{nonce}", uri="{path}", '
+                  f'algorithm=MD5, qop=auth, nc={nc}, cnonce="{cnonce}", response="{response}"')
+        if "opaque" in params:
+            header += f', opaque="{params["opaque"]}"'
+        return {"Authorization": header}
+
+    def run(self, command, *args, version=0):
+        """Run a calibredb command on the server and return its result"""
+        path = f"{self.prefix}/cdb/cmd/{command}/{version}"
+        if self.library_id:
+            path += "?" + urllib.parse.urlencode({"library_id": self.library_id})
+        body = msgpack_pack(list(args))
+        headers = {"Content-Type": MSGPACK_MIME, "Accept": "application/json"}
+        status, challenge, data = self.post(path, body, {**headers, **self.authorization("POST", path)})
+        if status == 401 and self.username and challenge:
+            # First request, or a stale digest nonce: answer the challenge once
+            scheme, _, rest = challenge.partition(" ")
+            params = {key: quoted or bare for key, quoted, bare in re.findall(r'(\w+)=(?:"([^"]*)"|([^\s,]*))', rest)}
+            with self.lock:
+                self.challenge = (scheme.lower(), params)
+                self.nonce_count = 0
+            status, challenge, data = self.post(path, body, {**headers, **self.authorization("POST", path)})
+        if status != 200:
+            raise CalibreServerError(f"HTTP {status} from {self.url}: {data.decode(errors='replace').strip()[:200]}")
+        try:
+            reply = json.loads(data)
+        except ValueError:
+            raise CalibreServerError(f"unexpected reply from {self.url}: {data[:80]!r}") from None
+        if "err" in reply:
+            raise CalibreServerError(reply["err"])
+        return reply["result"]
+
+    def books(self, library, search="", limit=-1):
+        """Books matching a Calibre search, by ID, with their format paths under the local `library`"""
+        with CALIBREDB_SECONDS.time(command="server_list"):
+            result = self.run("list", ["formats", "last_modified"], "id", True, search, limit)
+        if not isinstance(result, dict):
+            raise CalibreServerError(str(result))  # e.g. "Unknown fields: ..."
+        formats = result["data"].get("formats", {})
+        modified = result["data"].get("last_modified", {})
+        books = []
+        for book_id in result["book_ids"]:
+            # The server may mount the library elsewhere; Calibre keeps each book in <author>/<title (id)>/
+            files = [path.replace("\\", "/").split("/")[-3:] for path in formats.get(str(book_id)) or []]
+            book = Book(book_id, os.path.join(*files[0][:-1]) if files else "",
+                        last_modified=server_timestamp(modified.get(str(book_id))))
+            for parts in files:
+                fmt = Path(parts[-1]).suffix.lstrip(".").lower()
+                book.formats[fmt] = os.path.join(library, *parts)
+                try:
+                    book.sizes[fmt] = os.path.getsize(book.formats[fmt])
+                except OSError:
+                    book.sizes[fmt] = 0
+            books.append(book)
+        return books
+
+    def newest_change(self):
+        """ID and last_modified of the most recently changed book"""
+        result = self.run("list", ["last_modified"], "last_modified", False, "", 1)
+        if not isinstance(result, dict) or not result["book_ids"]:
+            return None
+        book_id = result["book_ids"][0]
+        return book_id, server_timestamp(result["data"]["last_modified"].get(str(book_id)))
+
+    def add_format(self, book_id, fmt, path):
+        """Upload a file as a format of the book, replacing an existing one"""
+        with open(path, "rb") as f:
+            data = f.read()
+        return bool(self.run("add_format", book_id, [path, data], fmt, True))
+
+def iter_books_from_server(server, library=CALIBRE_LIBRARY, since=None, also=()):
+    """iter_books() through a Calibre content server, a page of IDs at a time"""
+    also = sorted(set(also))
+    for start in range(0, len(also), SERVER_ID_CHUNK):
+        search = " or ".join(f"id:={book_id}" for book_id in also[start:start + SERVER_ID_CHUNK])
+        yield from server.books(library, search)
+    also = set(also)
+    changed = ""
+    if since:
+        # Calibre searches dates by whole days in the server's time zone: ask for a day more and cut here
+        with contextlib.suppress(ValueError):
+            day = datetime.date.fromisoformat(since[:10]) - datetime.timedelta(days=1)
+            changed = f" and last_modified:>={day.isoformat()}"
+    after = 0
+    while True:
+        books = server.books(library, f"id:>{after}{changed}", BOOK_PAGE)
+        if not books:
+            break
+        for book in books:
+            if book.id not in also and (not since or book.last_modified >= since):
+                yield book
+        after = books[-1].id
+
+def iter_books(library=CALIBRE_LIBRARY, since=None, also=(), server=None):
+    """Yield the library's books, with format paths, BOOK_PAGE at a time
+
+    The books in `also` (work carried over from an earlier run) come first, so
+    books deferred by --max-runtime are not always found last. Then come the
+    others, or with `since` only those whose last_modified is newer. The
+    calibredb fallback has no last_modified, so it always lists everything. Each
+    page is a separate short read of metadata.db, so a slow consumer neither
+    keeps Calibre from writing nor makes memory grow with the library. With a
+    `server`, metadata.db is not opened at all.
+    """
+    if server is not None:
+        yield from iter_books_from_server(server, library, since, also)
+        return
+    also = sorted(set(also))
+    yielded = set()  # books from `also` already yielded
+    after = 0  # highest book ID yielded from metadata.db
+    if Path(library, "metadata.db").exists():
+        try:
+            for start in range(0, len(also), BOOK_PAGE):
+                for book in read_books_from_db(library, ids=also[start:start + BOOK_PAGE]):
+                    yielded.add(book.id)
+                    yield book
+            while True:
+                conn = open_metadata_db(library)
+                try:
+                    ids = [row[0] for row in conn.execute(
+                        "SELECT id FROM books WHERE id > ? AND (? IS NULL OR last_modified >= ?) ORDER BY id LIMIT ?",
+                        (after, since, since, BOOK_PAGE)
+                    )]
+                finally:
+                    conn.close()
+                if not ids:
                     break
+                page = [book_id for book_id in ids if book_id not in yielded]
+                if page:
+                    yield from read_books_from_db(library, ids=page)
+                after = ids[-1]
+            return
+        except sqlite3.Error as e:
+            print(f"⚠️  Could not read metadata.db ({e}), falling back to calibredb")
+    yield from (book for book in read_books_from_calibredb(library) if book.id > after and book.id not in yielded)
 
-    if not source_path or not Path(source_path).exists():
-        # Alternative: find the file in library
-        success, stdout, stderr = run_command(
-            f"find {CALIBRE_LIBRARY} -name '*_{book_id}.{source_format}'"
+def get_all_books(library=CALIBRE_LIBRARY, since=None, also=(), server=None):
+    """Get all books, with format paths, from the library (see iter_books)"""
+    return sorted(iter_books(library, since, also, server), key=lambda book: book.id)
+
+class StateStore:
+    """Outcome of every conversion attempt, kept across runs in a small SQLite file
+
+    Rows are keyed by book ID and remember the source format, size and mtime the
+    outcome applies to, so a failed or skipped book is only looked at again once
+    its source file changes. The `last_modified` watermark lets the next run ask
+    metadata.db for changed books only; books left `pending` when a run ran out
+    of time are picked up again regardless of the watermark. Conversion
+    durations feed the scheduler's cost estimates.
+
+    Failed books form a retry queue: each failure pushes `next_attempt` out
+    exponentially, and after MAX_ATTEMPTS the book is `quarantined` until it is
+    cleared with --clear-quarantine.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversions (
+            book_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            source_format TEXT,
+            source_size INTEGER,
+            source_mtime REAL,
+            message TEXT,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    # Columns added after the first release, created on existing stores when missing
+    ADDED_COLUMNS = [
+        ("duration", "REAL"),
+        ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("timeouts", "INTEGER NOT NULL DEFAULT 0"),
+        ("next_attempt", "REAL"),
+        ("deferrals", "INTEGER NOT NULL DEFAULT 0"),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(conversions)")}
+        for name, declaration in self.ADDED_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE conversions ADD COLUMN {name} {declaration}")
+
+    @classmethod
+    def open(cls, state_dir):
+        """Open the store in `state_dir`, or an in-memory one if it cannot be created"""
+        try:
+            os.makedirs(state_dir, exist_ok=True)
+            return cls(os.path.join(state_dir, "state.db"))
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Cannot use state directory {state_dir} ({e}); results will not be remembered")
+            return cls(":memory:")
+
+    def get(self, book_id):
+        """Return (status, source_format, source_size, source_mtime, attempts, timeouts, next_attempt, deferrals),
+        or None"""
+        return self.conn.execute(
+            "SELECT status, source_format, source_size, source_mtime, attempts, timeouts, next_attempt, deferrals "
+            "FROM conversions WHERE book_id = ?",
+            (book_id,)
+        ).fetchone()
+
+    def record(self, book_id, status, source_format=None, signature=(None, None), message="", duration=None,
+               attempts=0, timeouts=0, next_attempt=None, deferrals=0):
+        """Remember the outcome for a book; call commit() to persist it"""
+        size, mtime = signature
+        self.conn.execute(
+            "INSERT OR REPLACE INTO conversions "
+            "(book_id, status, source_format, source_size, source_mtime, message, updated_at, duration, "
+            "attempts, timeouts, next_attempt, deferrals) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (book_id, status, source_format, size, mtime, message, time.time(), duration,
+             attempts, timeouts, next_attempt, deferrals)
+        )
+
+    def pending(self, now=None):
+        """IDs of books carried over from a run that hit --max-runtime, or due for a retry"""
+        now = time.time() if now is None else now
+        return [row[0] for row in self.conn.execute(
+            "SELECT book_id FROM conversions WHERE status = 'pending' "
+            "OR (status = 'failed' AND (next_attempt IS NULL OR next_attempt <= ?))",
+            (now,)
+        )]
+
+    def quarantined(self):
+        """[(book_id, source_format, attempts, updated_at, message)] of quarantined books"""
+        return self.conn.execute(
+            "SELECT book_id, source_format, attempts, updated_at, message FROM conversions "
+            "WHERE status = 'quarantined' ORDER BY book_id"
+        ).fetchall()
+
+    def clear_quarantine(self, book_ids=None):
+        """Release quarantined books (all of them without `book_ids`) so the next run tries them again
+
+        They become `pending` with no attempts: an incremental run would not find
+        them otherwise, since their last_modified is older than the watermark.
+        """
+        release = ("UPDATE conversions SET status = 'pending', attempts = 0, next_attempt = NULL, updated_at = ? "
+                   "WHERE status = 'quarantined'")
+        if book_ids:
+            placeholders = ",".join("?" * len(book_ids))
+            cursor = self.conn.execute(f"{release} AND book_id IN ({placeholders})", [time.time(), *book_ids])
+        else:
+            cursor = self.conn.execute(release, (time.time(),))
+        return cursor.rowcount
+
+    def cost_rates(self):
+        """Measured seconds per (MB + 1) of source, for formats with enough history"""
+        rows = self.conn.execute(
+            "SELECT source_format, SUM(duration), SUM(source_size / 1048576.0 + 1), COUNT(*) "
+            "FROM conversions WHERE status = 'converted' AND duration IS NOT NULL AND source_size IS NOT NULL "
+            "GROUP BY source_format"
+        )
+        return {fmt: seconds / units for fmt, seconds, units, count in rows if count >= MIN_COST_SAMPLES}
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def source_signature(path):
+    """Return (size, mtime) identifying the current contents of a source file"""
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return None, None
+
+# Calibre stores books as "Author/Title (ID)/Title - Author.fmt"; older imports used "name_ID.fmt"
+BOOK_DIR_ID = re.compile(r"\((\d+)\)$")
+BOOK_FILE_ID = re.compile(r"_(\d+)$")
+
+def build_library_index(library=CALIBRE_LIBRARY):
+    """Walk the library once and map (book ID, format) to file path"""
+    index = {}
+    pending = [(library, None)]
+    while pending:
+        directory, dir_book_id = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    match = BOOK_DIR_ID.search(entry.name)
+                    pending.append((entry.path, int(match.group(1)) if match else None))
+                    continue
+                stem, _, fmt = entry.name.rpartition(".")
+                if not stem or not fmt:
+                    continue
+                match = BOOK_FILE_ID.search(stem)
+                book_id = int(match.group(1)) if match else dir_book_id
+                if book_id is not None:
+                    index.setdefault((book_id, fmt.lower()), entry.path)
+    return index
+
+class LibraryIndex:
+    """Lazily built file index, shared by all workers and walked at most once per run"""
+
+    def __init__(self, library=CALIBRE_LIBRARY):
+        self.library = library
+        self._paths = None
+        self._lock = threading.Lock()
+
+    def lookup(self, book_id, fmt):
+        with self._lock:
+            if self._paths is None:
+                self._paths = build_library_index(self.library)
+        return self._paths.get((book_id, fmt.lower()))
+
+# Runs inside calibre-debug: reads one JSON job per line on stdin and answers on stdout.
+# Calibre's own output is sent to a per-job log file so it cannot corrupt the replies.
+WARM_WORKER_CODE = r"""
+import json, os, sys, traceback
+replies = os.fdopen(os.dup(1), "w", buffering=1)
+from calibre.ebooks.conversion.cli import main as ebook_convert
+for line in sys.stdin:
+    job = json.loads(line)
+    sys.stdout.flush(); sys.stderr.flush()
+    log = os.open(job["log"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log, 1); os.dup2(log, 2); os.close(log)
+    try:
+        status = ebook_convert(["ebook-convert", job["source"], job["output"]] + job.get("options", []))
+    except SystemExit as e:
+        status = e.code
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush(); sys.stderr.flush()
+    replies.write(json.dumps({"status": status or 0}) + "\n")
+"""
+
+class WarmWorker:
+    """A calibre-debug process that keeps Calibre's conversion modules loaded between books"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            ["calibre-debug", "-c", WARM_WORKER_CODE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            start_new_session=True
+        )
+        self.jobs = 0
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def convert(self, source, output, timeout=300, log=None, timer=None, options=()):
+        """Convert one book; returns (success, error message)
+
+        Calibre's output goes to `log` if given (kept), otherwise to a temporary file.
+        """
+        if log is None:
+            fd, log_path = tempfile.mkstemp(prefix="convert-", suffix=".log")
+            os.close(fd)
+        else:
+            log_path = log
+            open(log_path, "w").close()
+        try:
+            if self.jobs == 0:
+                timeout += WARM_WORKER_STARTUP
+            self.jobs += 1
+            job = {"source": str(source), "output": str(output), "log": log_path, "options": list(options)}
+            try:
+                self.proc.stdin.write(json.dumps(job) + "\n")
+                self.proc.stdin.flush()
+            except OSError as e:
+                self.close()
+                return False, f"Warm worker died: {e}"
+
+            if timer is None:
+                readable, _, _ = select.select([self.proc.stdout], [], [], timeout)
+            else:
+                readable = self.wait_timed(log_path, timeout, timer)
+            reply = self.proc.stdout.readline() if readable else ""
+            if not readable:
+                self.close()
+                return False, TIMEOUT_MESSAGE
+            if not reply:
+                self.close()
+                return False, f"Warm worker died: {tail_file(log_path)}"
+
+            if json.loads(reply)["status"] == 0:
+                return True, ""
+            return False, tail_file(log_path)
+        finally:
+            if log is None:
+                os.unlink(log_path)
+
+    def wait_timed(self, log_path, timeout, timer):
+        """Wait for the reply to a job while passing the lines Calibre logs to `timer`"""
+        deadline = time.monotonic() + timeout
+        pending = b""
+        with open(log_path, "rb") as log:
+            while True:
+                wait_for = min(0.1, max(0, deadline - time.monotonic()))
+                readable, _, _ = select.select([self.proc.stdout], [], [], wait_for)
+                *lines, pending = (pending + log.read()).split(b"\n")
+                for line in lines:
+                    timer.feed(line.decode(errors="replace"))
+                if readable or time.monotonic() >= deadline:
+                    return bool(readable)
+
+    def close(self):
+        """Stop the worker and anything it spawned"""
+        if self.alive():
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+class WarmWorkerPool:
+    """One warm worker per conversion thread, started on first use"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.available = True
+
+    def convert(self, source, output, timeout=300, log=None, timer=None, options=()):
+        worker = getattr(self.local, "worker", None)
+        if worker is None or not worker.alive() or worker.jobs >= WARM_WORKER_MAX_JOBS:
+            if worker is not None:
+                worker.close()
+            try:
+                worker = WarmWorker()
+            except OSError as e:
+                # calibre-debug is missing; every thread goes back to plain ebook-convert
+                if self.available:
+                    print(f"⚠️  Cannot start warm worker ({e}); using ebook-convert per book")
+                self.available = False
+                return None
+            self.local.worker = worker
+            with self.lock:
+                self.workers.append(worker)
+        return worker.convert(source, output, timeout, log, timer, options)
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.close()
+            self.workers.clear()
+
+def tail_file(path, lines=20):
+    """Return the last lines of a log file"""
+    try:
+        with open(path, errors="replace") as f:
+            return "".join(f.readlines()[-lines:]).strip()
+    except OSError:
+        return ""
+
+# In-process EPUB builder for sources that need none of Calibre's machinery (see build_epub)
+NATIVE_CHAPTER_SIZE = 200 * 1024  # characters per XHTML file when a book has no headings to split at
+# Larger sources go to ebook-convert, whose memory the MemoryGovernor sees; a pool thread's it does not
+NATIVE_MAX_SIZE = 16 * 1024 * 1024
+NATIVE_HEADING = re.compile(  # "Chapter 3", "Part II: Home", "Prologue", a lone "XII" or "12."
+    r"(?:chapter|cap[íi]tulo|part|parte|book|livro)\s+"
+    r"(?:(?:\d+|(?-i:[IVXLCDM]+))\b.*|\w+[.:]?(?:\s*[-—:.]\s*.*)?)$"
+    r"|(?:prologue|pr[óo]logo|epilogue|ep[íi]logo|interlude)[.:]?(?:\s*[-—:.]\s*.*)?$"
+    r"|(?-i:[IVXLC]+)\.?$|\d{1,3}\.?$",
+    re.IGNORECASE
+)
+MARKDOWN_HEADING = re.compile(r"^#+\s+")
+XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+RTF_TOKEN = re.compile(r"\\([a-z]+)(-?\d+)? ?|\\'([0-9a-fA-F]{2})|\\([^a-z'])|([{}])|(\r\n|\r|\n)|([^\\{}\r\n]+)")
+RTF_CHUNK = 1024 * 1024  # characters of RTF tokenized at a time
+RTF_LOOKAHEAD = 64  # longer than any control word with its argument
+RTF_UNSUPPORTED = ("pict", "object", "trowd", "bin")  # images, embedded objects, tables, binary data
+RTF_SKIPPED = {  # destinations without text for the reader
+    "fonttbl", "colortbl", "stylesheet", "info", "header", "headerl", "headerr", "headerf", "footer", "footerl",
+    "footerr", "footerf", "listtable", "listoverridetable", "revtbl", "rsidtbl", "generator", "fldinst",
+    "xmlnstbl", "filetbl", "themedata", "colorschememapping", "latentstyles", "datastore",
+}
+RTF_WORDS = {
+    "tab": " ", "line": "\n", "emdash": "\u2014", "endash": "\u2013", "lquote": "\u2018", "rquote": "\u2019",
+    "ldblquote": "\u201c", "rdblquote": "\u201d", "bullet": "\u2022", "emspace": "\u2003", "enspace": "\u2002",
+}
+RTF_SYMBOLS = {"~": "\u00a0", "_": "\u2011", "-": ""}
+SURROGATE = re.compile("[\ud800-\udfff]")
+
+EPUB_CONTAINER = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+EPUB_STYLE = "p { margin: 0 0 0.6em; }\nh2 { text-align: center; margin: 2em 0 1em; }\n"
+EPUB_PAGE = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>{title}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>
+<body>
+"""
+EPUB_OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="uid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:title>{title}</dc:title>
+    <dc:creator opf:role="aut">{author}</dc:creator>
+    <dc:language>und</dc:language>
+    <dc:identifier id="uid">{identifier}</dc:identifier>
+  </metadata>
+  <manifest>
+    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
+    <item id="style" href="style.css" media-type="text/css"/>
+{manifest}  </manifest>
+  <spine toc="ncx">
+{spine}  </spine>
+</package>
+"""
+EPUB_NCX = """<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta name="dtb:uid" content="{identifier}"/>
+    <meta name="dtb:depth" content="1"/>
+    <meta name="dtb:totalPageCount" content="0"/>
+    <meta name="dtb:maxPageNumber" content="0"/>
+  </head>
+  <docTitle><text>{title}</text></docTitle>
+  <navMap>
+{nav}  </navMap>
+</ncx>
+"""
+
+class NativeUnsupported(ValueError):
+    """A source the in-process EPUB builder leaves to ebook-convert"""
+
+def profile_options(profile, source):
+    """ebook-convert options of a conversion profile for a source file, or NATIVE_BUILD"""
+    options = CONVERSION_PROFILES[profile]
+    return options.get(Path(source).suffix.lstrip(".").lower(), options["*"])
+
+def text_encoding(path):
+    """Encoding of a text file: from its BOM, else UTF-8 if it decodes, else Windows-1252"""
+    with open(path, "rb") as f:
+        head = f.read(4)
+        if head.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return "utf-16"
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1252"
+    return "utf-8"
+
+def text_paragraphs(path):
+    """Yield the paragraphs of a TXT file, each a list of (text, bold, italic) runs
+
+    Like Calibre's "auto" paragraph style: when blank lines separate
+    paragraphs, hard-wrapped lines are joined; otherwise every line is one.
+    """
+    with open(path, encoding=text_encoding(path), errors="replace", newline=None) as f:
+        head = list(itertools.islice(f, 1000))
+        blocks = sum(1 for line in head if not line.strip()) >= len(head) * 0.05
+        paragraph = []
+        for line in itertools.chain(head, f):
+            line = MARKDOWN_HEADING.sub("", line.strip())
+            if line:
+                paragraph.append(line)
+            if paragraph and (not blocks or not line):
+                yield [(" ".join(paragraph), False, False)]
+                paragraph = []
+        if paragraph:
+            yield [(" ".join(paragraph), False, False)]
+
+def rtf_tokens(f):
+    """RTF_TOKEN matches of a file read RTF_CHUNK characters at a time
+
+    Tokens reaching into the last RTF_LOOKAHEAD characters of a chunk may
+    continue in the next one, so they are matched again with it. Plain text
+    can be split anywhere, so a long run of it is never held back whole.
+    """
+    tail = ""
+    for chunk in iter(lambda: f.read(RTF_CHUNK), ""):
+        buffer = tail + chunk
+        safe = len(buffer) - RTF_LOOKAHEAD
+        position = 0
+        for match in RTF_TOKEN.finditer(buffer):
+            if match.end() > safe:
+                if match.group(7) is not None and match.start() < safe:
+                    yield ("",) * 6 + (buffer[match.start():safe],)
+                    position = safe
+                break
+            yield match.groups("")
+            position = match.end()
+        tail = buffer[position:]
+    for match in RTF_TOKEN.finditer(tail):
+        yield match.groups("")
+
+def rtf_paragraphs(path):
+    """Yield the paragraphs of an RTF file, each a list of (text, bold, italic) runs
+
+    Handles text, Unicode and code page escapes, bold and italic. Images,
+    embedded objects and tables raise NativeUnsupported, for ebook-convert.
+    The file is tokenized as it is read; only the current paragraph is held.
+    """
+    with open(path, encoding="latin-1", newline="") as f:
+        if f.read(5) != "{\\rtf":
+            raise NativeUnsupported("not an RTF document")
+        f.seek(0)
+        yield from rtf_document(rtf_tokens(f))
+
+def rtf_document(tokens):
+    """The paragraphs of an RTF document from its tokens (see rtf_paragraphs)"""
+    codepage = "cp1252"
+    group = {"skip": False, "uc": 1, "bold": False, "italic": False}
+    stack = []
+    skip_chars = 0  # fallback characters still to drop after a \uN
+    pending = bytearray()  # code page bytes not decoded yet
+    runs = []  # ([text, ...], bold, italic), joined once the paragraph is complete
+
+    def text(value):
+        if value and runs and runs[-1][1:] == (group["bold"], group["italic"]):
+            runs[-1][0].append(value)
+        elif value:
+            runs.append(([value], group["bold"], group["italic"]))
+
+    def flush():
+        if pending:
+            text(pending.decode(codepage, errors="replace"))
+            pending.clear()
+
+    def paragraph():
+        # \uN escapes split characters outside the BMP into UTF-16 surrogates; pair them up again
+        values = ["".join(pieces) for pieces, _, _ in runs]
+        values = [value.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+                  if SURROGATE.search(value) else value for value in values]
+        return [(value, bold, italic) for value, (_, bold, italic) in zip(values, runs)]
+
+    for word, argument, hex_byte, symbol, brace, newline, plain in tokens:
+        if word in RTF_UNSUPPORTED:
+            raise NativeUnsupported(f"RTF with \\{word}")
+        if symbol in ("\n", "\r"):
+            word, symbol = "par", ""  # a backslash before a line break is a \par
+        if plain or hex_byte:
+            if group["skip"]:
+                continue
+            if skip_chars:
+                if hex_byte:
+                    skip_chars -= 1
+                    continue
+                plain, skip_chars = plain[skip_chars:], max(0, skip_chars - len(plain))
+            if plain and plain.isascii() and not pending:
+                text(plain)  # the same in every code page
+            else:
+                pending.extend(plain.encode("latin-1") if plain else bytes.fromhex(hex_byte))
+            continue
+        flush()
+        if brace == "{":
+            stack.append(group)
+            group = dict(group)
+        elif brace == "}":
+            group = stack.pop() if stack else group
+        elif newline or group["skip"] and not (symbol == "*" or word in RTF_SKIPPED):
+            continue
+        elif symbol == "*" or word in RTF_SKIPPED:
+            group["skip"] = True
+        elif symbol:
+            text(RTF_SYMBOLS.get(symbol, symbol if symbol in "\\{}" else ""))
+        elif word == "u":
+            text(chr(int(argument) % 65536))
+            skip_chars = group["uc"]
+        elif word == "uc":
+            group["uc"] = int(argument or 1)
+        elif word == "ansicpg":
+            with contextlib.suppress(LookupError):
+                codepage = codecs.lookup(f"cp{argument}").name
+        elif word in ("b", "i"):
+            group["bold" if word == "b" else "italic"] = argument != "0"
+        elif word == "plain":
+            group["bold"] = group["italic"] = False
+        elif word in ("par", "sect", "page"):
+            if runs:
+                yield paragraph()
+            runs = []
+        elif word in RTF_WORDS:
+            text(RTF_WORDS[word])
+    flush()
+    if runs:
+        yield paragraph()
+
+def book_names(source):
+    """(title, author) of a book from Calibre's <author>/<title (id)>/ folders, or the file name"""
+    folder = Path(source).parent
+    if BOOK_DIR_ID.search(folder.name):
+        return BOOK_DIR_ID.sub("", folder.name).strip(), folder.parent.name
+    return Path(source).stem, "Unknown"
+
+def build_epub(source, output):
+    """Package a TXT or RTF source as an EPUB 2 without Calibre
+
+    Paragraphs are streamed into XHTML files of up to NATIVE_CHAPTER_SIZE
+    characters, starting a new one at each chapter heading, and the OPF and
+    NCX are written once every file is known. Raises NativeUnsupported (or
+    OSError) when ebook-convert has to do it instead.
+    """
+    if os.path.getsize(source) > NATIVE_MAX_SIZE:
+        raise NativeUnsupported("too large to build in-process")
+    rtf = Path(source).suffix.lower() == ".rtf"
+    paragraphs = rtf_paragraphs(source) if rtf else text_paragraphs(source)
+    title, author = book_names(source)
+    chapters = []  # (file name, heading)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as epub:
+        # The mimetype comes first and uncompressed, so readers can sniff it
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", EPUB_CONTAINER)
+        epub.writestr("OEBPS/style.css", EPUB_STYLE)
+        chapter = None
+        size = 0
+        try:
+            for runs in paragraphs:
+                plain = XML_INVALID.sub("", "".join(run[0] for run in runs)).strip()
+                if not plain:
+                    continue
+                heading = len(runs) == 1 and len(plain) <= 80 and NATIVE_HEADING.match(plain) is not None
+                if chapter is None or (heading and size) or size >= NATIVE_CHAPTER_SIZE:
+                    if chapter is not None:
+                        chapter.write(b"</body>\n</html>\n")
+                        chapter.close()
+                    name = f"text{len(chapters) + 1:04d}.xhtml"
+                    chapters.append((name, plain if heading else None))
+                    chapter = epub.open(f"OEBPS/{name}", "w")
+                    chapter.write(EPUB_PAGE.format(title=html.escape(title)).encode())
+                    size = 0
+                if heading:
+                    chapter.write(f"<h2>{html.escape(plain, quote=False)}</h2>\n".encode())
+                else:
+                    body = []
+                    for value, bold, italic in runs:
+                        value = html.escape(XML_INVALID.sub("", value), quote=False).replace("\n", "<br/>")
+                        value = f"<i>{value}</i>" if italic else value
+                        body.append(f"<b>{value}</b>" if bold else value)
+                    chapter.write(f"<p>{''.join(body).strip()}</p>\n".encode())
+                size += len(plain)
+        finally:
+            if chapter is not None:
+                chapter.write(b"</body>\n</html>\n")
+                chapter.close()
+        if not chapters:
+            raise NativeUnsupported("no text")
+
+        identifier = f"urn:uuid:{uuid.uuid4()}"
+        escape = html.escape
+        manifest = "".join(f'    <item id="c{n}" href="{name}" media-type="application/xhtml+xml"/>\n'
+                           for n, (name, _) in enumerate(chapters))
+        spine = "".join(f'    <itemref idref="c{n}"/>\n' for n in range(len(chapters)))
+        epub.writestr("OEBPS/content.opf", EPUB_OPF.format(
+            title=escape(title), author=escape(author), identifier=identifier, manifest=manifest, spine=spine
+        ))
+        # The table of contents lists the chapter headings, or just the start of a book without any
+        points = [(name, heading) for name, heading in chapters if heading] or [(chapters[0][0], title)]
+        nav = "".join(
+            f'    <navPoint id="n{n}" playOrder="{n + 1}"><navLabel><text>{escape(label)}</text></navLabel>'
+            f'<content src="{name}"/></navPoint>\n'
+            for n, (name, label) in enumerate(points)
+        )
+        epub.writestr("OEBPS/toc.ncx", EPUB_NCX.format(title=escape(title), identifier=identifier, nav=nav))
+
+def run_ebook_convert(source, output, warm=None, timeout=300, log=None, timer=None, options=()):
+    """Convert a file with ebook-convert, on a warm worker when one is available
+
+    With `log`, Calibre's output is streamed to that file instead of being kept
+    in memory, and `timer` (a StageTimer) sees each line as it is written.
+    `options` are extra ebook-convert options (see profile_options). With
+    NATIVE_BUILD, EPUBs are built in-process by build_epub(), in milliseconds,
+    and ebook-convert only gets the sources it cannot handle.
+    """
+    if options == NATIVE_BUILD:
+        options = []
+        if Path(output).suffix.lower() == ".epub":
+            try:
+                build_epub(source, output)
+                if log is not None:
+                    with open(log, "w") as f:
+                        f.write(f"EPUB built in-process from {source}\n")
+                return True, ""
+            except (ValueError, OSError):
+                Path(output).unlink(missing_ok=True)  # e.g. an RTF with images: Calibre converts it
+    if warm is not None and warm.available:
+        result = warm.convert(source, output, timeout, log, timer, options)
+        if result is not None:
+            return result
+    cmd = ["ebook-convert", str(source), str(output), *options]
+    if log is not None:
+        return run_logged(cmd, log, timeout, timer)
+    success, stdout, stderr = run_command(cmd, timeout=timeout)
+    return success, stderr
+
+def run_logged(cmd, log, timeout=300, timer=None):
+    """Run a command with stdout and stderr streamed to a log file; returns (success, error)"""
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            start_new_session=True
+        )
+    except OSError as e:
+        return False, str(e)
+    deadline = time.monotonic() + timeout
+    pending = b""
+    with proc, open(log, "wb") as out:
+        while True:
+            remaining = deadline - time.monotonic()
+            readable = remaining > 0 and select.select([proc.stdout], [], [], remaining)[0]
+            if not readable:
+                with contextlib.suppress(OSError):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                return False, TIMEOUT_MESSAGE
+            chunk = os.read(proc.stdout.fileno(), 65536)
+            if not chunk:
+                break
+            out.write(chunk)
+            if timer is not None:
+                *lines, pending = (pending + chunk).split(b"\n")
+                for line in lines:
+                    timer.feed(line.decode(errors="replace"))
+        proc.wait()
+    if proc.returncode == 0:
+        return True, ""
+    return False, tail_file(log)
+
+class StageTimer:
+    """Splits a conversion's time into stages using the progress lines Calibre prints"""
+
+    def __init__(self):
+        self.stage = "startup"
+        self.since = time.monotonic()
+        self.stages = {}
+
+    def feed(self, line):
+        for stage, pattern in STAGE_MARKERS:
+            if pattern.match(line.strip()):
+                self.enter(stage)
+                return
+
+    def enter(self, stage):
+        if stage == self.stage:
+            return
+        now = time.monotonic()
+        if self.stage is not None:
+            self.stages[self.stage] = self.stages.get(self.stage, 0) + now - self.since
+        self.stage = stage
+        self.since = now
+
+    def finish(self):
+        """Stage name -> seconds"""
+        self.enter(None)
+        return self.stages
+
+def cgroup_dir():
+    """This process's cgroup v2 directory, or None without cgroup v2"""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    # Under a private cgroup namespace (the Docker default) this is "/", the mount root
+                    path = os.path.normpath(os.path.join(CGROUP_ROOT, line[3:].strip().lstrip("/")))
+                    if os.path.exists(os.path.join(path, "cgroup.controllers")):
+                        return path
+    except OSError:
+        pass
+    return CGROUP_ROOT if os.path.exists(os.path.join(CGROUP_ROOT, "memory.current")) else None
+
+def read_cgroup_file(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def cgroup_ancestors(directory):
+    """The cgroup and its parents up to the mount root; limits of any of them apply"""
+    while directory:
+        yield directory
+        if directory == CGROUP_ROOT or not directory.startswith(CGROUP_ROOT):
+            return
+        directory = os.path.dirname(directory)
+
+def cpu_limit(cgroup=None):
+    """CPUs this process may use: its affinity mask, capped by the cgroup's cpu.max quota"""
+    cpus = float(len(os.sched_getaffinity(0)))
+    for directory in cgroup_ancestors(cgroup):
+        quota = (read_cgroup_file(directory, "cpu.max") or "max").split()
+        if quota[0] != "max":
+            cpus = min(cpus, int(quota[0]) / int(quota[1]))
+    return cpus
+
+def memory_limit(cgroup=None):
+    """Bytes of memory available to this process: the cgroup's memory.high/max, else physical memory"""
+    limits = []
+    for directory in cgroup_ancestors(cgroup):
+        for name in ("memory.max", "memory.high"):
+            value = read_cgroup_file(directory, name)
+            if value and value != "max":
+                limits.append(int(value))
+    if limits:
+        return min(limits)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def process_memory(pid):
+    """(RSS, peak RSS) of a process in bytes"""
+    rss = peak = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return rss, peak
+
+def child_processes():
+    """Process IDs of this process's descendants, grouped by child: {child: [child, grandchildren...]}"""
+    children = collections.defaultdict(list)
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces and parentheses; the parent PID follows the last ")"
+        children[int(stat.rsplit(")", 1)[1].split()[1])].append(int(entry.name))
+    trees = {}
+    for child in children[os.getpid()]:
+        tree = trees[child] = []
+        stack = [child]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children[pid])
+    return trees
+
+def auto_jobs(cgroup=None):
+    """Parallel conversions that fit the CPU quota and memory limit; returns (jobs, description)"""
+    cpus = cpu_limit(cgroup)
+    jobs = max(1, math.ceil(cpus))
+    memory = memory_limit(cgroup)
+    if memory:
+        jobs = max(1, min(jobs, int(memory * MEMORY_HEADROOM // JOB_MEMORY)))
+        return jobs, f"{cpus:g} CPUs, {memory / 1073741824:.1f} GiB memory"
+    return jobs, f"{cpus:g} CPUs"
+
+class MemoryGovernor:
+    """Holds back new conversions while the running ones are close to the memory limit
+
+    Usage is the cgroup's memory.current without reclaimable page cache (so
+    tmpfs scratch space counts), or the RSS of this process tree outside a
+    cgroup. A new conversion is assumed to need as much as the largest peak RSS
+    of a conversion process so far, or JOB_MEMORY until enough were measured.
+    In distributed mode (`remote`, a RemoteQueue) conversions handed to a worker
+    do not count; the others, and the next one, run here as far as it knows, since
+    sources too big for Redis and jobs without a live worker fall back locally.
+    """
+
+    def __init__(self, cgroup=None, limit=None, remote=None):
+        self.cgroup = cgroup
+        self.limit = limit
+        self.remote = remote
+        self.peak = 0
+        self.samples = 0
+        self.base = self.usage()
+        self.current = self.base
+        self.held = 0.0
+        self.held_since = None
+        MEMORY_LIMIT.set(limit or 0)
+
+    @classmethod
+    def open(cls, remote=None):
+        cgroup = cgroup_dir()
+        return cls(cgroup, memory_limit(cgroup), remote)
+
+    def usage(self):
+        if self.cgroup:
+            current = read_cgroup_file(self.cgroup, "memory.current")
+            if current is not None:
+                stat = dict(line.split() for line in (read_cgroup_file(self.cgroup, "memory.stat") or "").splitlines())
+                return max(0, int(current) - int(stat.get("inactive_file", 0)))
+        return sum(process_memory(pid)[0] for tree in [[os.getpid()], *child_processes().values()] for pid in tree)
+
+    def job_memory(self):
+        if self.samples < MIN_MEMORY_SAMPLES:
+            return max(self.peak, JOB_MEMORY)
+        return self.peak
+
+    def budget(self, jobs):
+        """Memory each of `jobs` parallel conversions may use"""
+        if self.limit is None:
+            return None
+        return max(0, self.limit * MEMORY_HEADROOM - self.base) / jobs
+
+    def sample(self):
+        """Measure usage and the peak memory of running conversion processes"""
+        trees = child_processes()
+        if trees:
+            self.samples += 1
+            self.peak = max(self.peak, *(sum(process_memory(pid)[1] for pid in tree) for tree in trees.values()))
+        self.current = self.usage()
+        self.base = min(self.base, self.current)  # what the converter needs without conversions
+        MEMORY_USAGE.set(self.current)
+        JOB_MEMORY_BYTES.set(self.job_memory())
+
+    def can_start(self, running):
+        """Whether one more conversion fits next to `running` ones; the first always does"""
+        local = running - (self.remote.in_flight if self.remote is not None else 0)
+        projected = max(self.current, self.base + self.job_memory() * max(0, local))
+        fits = running == 0 or self.limit is None or projected + self.job_memory() <= self.limit * MEMORY_HEADROOM
+        now = time.monotonic()
+        if fits and self.held_since is not None:
+            self.held += now - self.held_since
+            MEMORY_HELD_SECONDS.inc(now - self.held_since)
+            self.held_since = None
+        elif not fits and self.held_since is None:
+            self.held_since = now
+        return fits
+
+    def held_seconds(self):
+        """Time spent holding conversions back, including an ongoing wait"""
+        if self.held_since is None:
+            return self.held
+        return self.held + time.monotonic() - self.held_since
+
+def read_pressure(path):
+    """PSI "some avg10" of a /proc/pressure file: % of the last 10s some task was stalled, or None"""
+    try:
+        with open(path) as f:
+            fields = dict(field.split("=") for field in f.readline().split()[1:])
+        return float(fields["avg10"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+class HostPressure:
+    """Lowers the number of conversions allowed to start while the host is busy
+
+    Readings are host-wide PSI for CPU and IO and the 1-minute load average per
+    CPU. While any is above its threshold the limit halves every PRESSURE_STEP
+    seconds, down to 0 (paused); once all are below QUIET_FACTOR of their
+    thresholds it grows back by one per step. Running conversions are left alone.
+    """
+
+    def __init__(self, jobs, max_cpu=DEFAULT_MAX_CPU_PRESSURE, max_io=DEFAULT_MAX_IO_PRESSURE,
+                 max_load=DEFAULT_MAX_LOAD):
+        self.jobs = jobs
+        self.thresholds = {
+            resource: threshold
+            for resource, threshold in (("cpu", max_cpu), ("io", max_io), ("load", max_load))
+            if threshold
+        }
+        self.allowed = jobs
+        self.stepped = 0.0
+        self.checked = None
+        self.paused = 0.0
+        self.throttled = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.jobs, args.max_cpu_pressure, args.max_io_pressure, args.max_load)
+
+    def readings(self):
+        values = {}
+        for resource in ("cpu", "io"):
+            if resource in self.thresholds:
+                value = read_pressure(PSI_FILES[resource])
+                if value is not None:
+                    values[resource] = value
+        if "load" in self.thresholds:
+            values["load"] = os.getloadavg()[0] / (os.cpu_count() or 1)
+        return values
+
+    def update(self, waiting=True):
+        """Account for time spent below full speed and step the limit; returns how many may run"""
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is not None and waiting:
+                if self.allowed == 0:
+                    self.paused += now - self.checked
+                    PAUSED_SECONDS.inc(now - self.checked)
+                elif self.allowed < self.jobs:
+                    self.throttled += now - self.checked
+            self.checked = now
+            if now - self.stepped < PRESSURE_STEP:
+                return self.allowed
+            self.stepped = now
+
+            values = self.readings()
+            for resource, value in values.items():
+                HOST_PRESSURE.set(value, resource=resource)
+            busy = [resource for resource, value in values.items() if value > self.thresholds[resource]]
+            if busy:
+                allowed = self.allowed // 2
+            elif all(value < self.thresholds[resource] * QUIET_FACTOR for resource, value in values.items()):
+                allowed = min(self.jobs, self.allowed + 1)
+            else:
+                allowed = self.allowed
+            if allowed == 0 and self.allowed:
+                described = ", ".join(
+                    f"load {values[r]:.1f}/CPU" if r == "load" else f"{r} pressure {values[r]:.0f}%" for r in busy
+                )
+                print(f"\n⏸️  Host busy ({described}); pausing new conversions")
+            elif allowed and not self.allowed:
+                print(f"\n▶️  Host quiet again; resuming conversions")
+            self.allowed = allowed
+            DISPATCH_LIMIT.set(allowed)
+            return allowed
+
+class Profiler:
+    """Logs and stage timings of every conversion in a pass, and a ranked report (--profile-dir)
+
+    Calibre's output for each conversion goes to logs/<book>-<format>.log, each
+    conversion is appended to conversions.jsonl, and report() ranks the pass's
+    slowest books and stages and compares conversion with calibredb time.
+    Conversions done by distributed workers are timed but not split into stages.
+    """
+
+    def __init__(self, directory, profile=DEFAULT_PROFILE):
+        self.directory = directory
+        self.profile = profile
+        self.logs = os.path.join(directory, "logs")
+        os.makedirs(self.logs, exist_ok=True)
+        self.records = []
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.calibredb = self.calibredb_totals()
+
+    @classmethod
+    def open(cls, directory, profile=DEFAULT_PROFILE):
+        if not directory:
+            return None
+        try:
+            return cls(directory, profile)
+        except OSError as e:
+            print(f"⚠️  Profiling disabled ({e})")
+            return None
+
+    @staticmethod
+    def calibredb_totals():
+        with CALIBREDB_SECONDS.lock:
+            return {key[0]: (total, count) for key, (_, total, count) in CALIBREDB_SECONDS.values.items()}
+
+    def convert(self, job, source, output, fmt, warm=None, options=()):
+        """run_ebook_convert with the output logged and timed; returns (success, error)"""
+        log = os.path.join(self.logs, f"{job.book.id}-{fmt}.log")
+        timer = StageTimer()
+        started = time.monotonic()
+        success, error = run_ebook_convert(source, output, warm, job.timeout, log, timer, options)
+        record = {
+            "book_id": job.book.id,
+            "source_format": Path(source).suffix.lstrip(".").lower(),
+            "format": fmt,
+            "size": os.path.getsize(source),
+            "seconds": round(time.monotonic() - started, 3),
+            "stages": {stage: round(seconds, 3) for stage, seconds in timer.finish().items()},
+            "success": success,
+            "log": log,
+        }
+        with self.lock:
+            self.records.append(record)
+            with open(os.path.join(self.directory, "conversions.jsonl"), "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return success, error
+
+    def report(self):
+        """Write report.txt for the conversions since this profiler was opened; returns its path
+
+        A pass without conversions leaves the previous report alone and returns None.
+        """
+        with self.lock:
+            records = list(self.records)
+        if not records:
+            return None
+        calibredb = {}
+        for command, (total, count) in self.calibredb_totals().items():
+            before, calls = self.calibredb.get(command, (0.0, 0))
+            if count > calls:
+                calibredb[command] = (total - before, count - calls)
+        converting = sum(record["seconds"] for record in records)
+        library = sum(total for total, _ in calibredb.values())
+        busy = converting + library or 1
+
+        lines = [
+            f"Conversion profile, {time.strftime('%Y-%m-%d %H:%M:%S')} (--conversion-profile {self.profile})",
+            f"{len(records)} conversions in {format_duration(time.monotonic() - self.started)}",
+            "",
+            "Time spent (summed over parallel workers):",
+            f"  {'conversion':<16} {converting:>10.1f}s {converting / busy:>7.1%}",
+            f"  {'calibredb':<16} {library:>10.1f}s {library / busy:>7.1%}",
+        ]
+        for command, (total, count) in sorted(calibredb.items(), key=lambda item: -item[1][0]):
+            lines.append(f"    {command:<14} {total:>10.1f}s  {count} calls, {total / count:.2f}s each")
+
+        stages = {stage: sum(record["stages"].get(stage, 0) for record in records) for stage in STAGES}
+        staged = sum(stages.values())
+        if staged:
+            lines += ["", "Slowest stages:"]
+            for stage, total in sorted(stages.items(), key=lambda item: -item[1]):
+                lines.append(f"  {stage:<16} {total:>10.1f}s {total / staged:>7.1%}  "
+                             f"{total / len(records):.2f}s per conversion")
+
+        formats = collections.defaultdict(list)
+        for record in records:
+            formats[f"{record['source_format']} → {record['format']}"].append(record["seconds"])
+        lines += ["", "By format:"]
+        for name, seconds in sorted(formats.items(), key=lambda item: -sum(item[1])):
+            lines.append(f"  {name:<16} {sum(seconds):>10.1f}s  {len(seconds)} conversions, "
+                         f"{sum(seconds) / len(seconds):.2f}s each, slowest {max(seconds):.1f}s")
+
+        lines += [
+            "",
+            f"Slowest conversions (top {PROFILE_TOP}):",
+            f"  {'book':<8} {'format':<14} {'MB':>7} {'total':>8}  "
+            + "  ".join(f"{stage:>10}" for stage in STAGES) + "  log",
+        ]
+        for record in heapq.nlargest(PROFILE_TOP, records, key=lambda record: record["seconds"]):
+            lines.append(
+                f"  #{record['book_id']:<7} {record['source_format'] + ' → ' + record['format']:<14} "
+                f"{record['size'] / 1048576:>7.1f} {record['seconds']:>7.1f}s  "
+                + "  ".join(f"{record['stages'].get(stage, 0):>9.1f}s" for stage in STAGES)
+                + f"  {record['log']}" + ("" if record["success"] else "  (failed)")
+            )
+
+        path = os.path.join(self.directory, "report.txt")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary, path)
+        return path
+
+@dataclass
+class Job:
+    """One book to convert into one or more formats, and where the converted files are"""
+    book: Book
+    source_format: str
+    signature: tuple
+    targets: list = field(default_factory=lambda: [CONVERT_TO])  # missing formats, in conversion order
+    outputs: dict = field(default_factory=dict)  # format -> converted file, in scratch and then in the library
+    source_hash: str = ""
+    reused: bool = False  # every output came from the conversion cache
+    cost: float = 0.0  # estimated seconds of conversion
+    duration: float = None  # measured seconds of conversion
+    attempts: int = 0  # earlier failed attempts with this source file
+    timeouts: int = 0  # how many of those timed out
+    deferrals: int = 0  # runs in a row that carried the book over for --max-runtime
+    timed_out: bool = False
+    markers: list = field(default_factory=list)  # publishing markers, removed once the files are registered
+
+    @property
+    def timeout(self):
+        """Seconds this conversion may take, doubled for every earlier timeout"""
+        timeout = max(MIN_TIMEOUT, self.cost * TIMEOUT_COST_FACTOR) * 2 ** self.timeouts
+        return min(MAX_TIMEOUT, timeout)
+
+def estimate_cost(job, rates):
+    """Estimated seconds to convert a job, from its source format and size
+
+    The first target is converted from the source, the others from the fresh
+    EPUB when it is one of the targets, or from the source again otherwise.
+    """
+    size = job.signature[0] or job.book.sizes.get(job.source_format, 0)
+
+    def rate(fmt):
+        return rates.get(fmt, FORMAT_COST.get(fmt, DEFAULT_FORMAT_COST))
+
+    derived = rate(DERIVE_FROM) if job.targets[0] == DERIVE_FROM else rate(job.source_format)
+    return (rate(job.source_format) + derived * (len(job.targets) - 1)) * (size / 1048576 + 1)
+
+def format_duration(seconds):
+    """Human readable duration, e.g. 2h 05m"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+def parse_formats(value):
+    """argparse type for a comma-separated list of formats, e.g. epub,azw3"""
+    formats = []
+    for fmt in value.lower().split(","):
+        fmt = fmt.strip().lstrip(".")
+        if fmt and fmt not in formats:
+            formats.append(fmt)
+    if not formats:
+        raise argparse.ArgumentTypeError(f"no formats in {value!r}")
+    return formats
+
+def parse_duration(value):
+    """argparse type for durations: plain seconds or a number with s/m/h suffix"""
+    units = {"s": 1, "m": 60, "h": 3600}
+    try:
+        if value and value[-1].lower() in units:
+            return float(value[:-1]) * units[value[-1].lower()]
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r} (use e.g. 5400, 90m or 6h)")
+
+HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="hash")
+
+def hash_file(path):
+    """Content hash of a file, read through mmap
+
+    Large files are split into chunks hashed in parallel (hashlib releases the
+    GIL) and the chunk digests are hashed again, so the result only depends on
+    the file contents. Chunks are memoryview slices, hashed without a copy.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hashlib.blake2b(b"", digest_size=32).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if size <= HASH_CHUNK_SIZE:
+                return hashlib.blake2b(data, digest_size=32).hexdigest()
+            with memoryview(data) as view:  # released before the mmap is closed
+                digests = list(HASH_POOL.map(
+                    lambda start: hashlib.blake2b(view[start:start + HASH_CHUNK_SIZE], digest_size=32).digest(),
+                    range(0, size, HASH_CHUNK_SIZE)
+                ))
+    tree = hashlib.blake2b(size.to_bytes(8, "little"), digest_size=32)
+    for digest in digests:
+        tree.update(digest)
+    return tree.hexdigest()
+
+def link_or_copy(source, destination):
+    """Hard link when possible (cache and scratch on the same filesystem), copy otherwise"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class ConversionCache:
+    """Converted files keyed by the content hash of their source, shared between runs
+
+    Entries are evicted least-recently-used (by mtime, refreshed on every hit)
+    once the cache grows past `max_bytes`, during a run as well as at its end.
+    A per-hash lock makes identical books converted in the same run wait for
+    the first one instead of converting the same file twice. On the same
+    filesystem as the scratch directory, entries are hard links and cost no
+    copy.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+        self.size_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    @classmethod
+    def open(cls, directory, max_mb):
+        if max_mb <= 0:
+            return None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fs = os.statvfs(directory)
+            return cls(directory, min(max_mb * 1024 * 1024, int(fs.f_blocks * fs.f_frsize * CACHE_FILESYSTEM_SHARE)))
+        except OSError as e:
+            print(f"⚠️  Conversion cache disabled ({e})")
+            return None
+
+    def lock(self, source_hash):
+        with self.locks_guard:
+            return self.locks.setdefault(source_hash, threading.Lock())
+
+    def entry(self, source_hash, fmt):
+        return os.path.join(self.directory, f"{source_hash}.{fmt}")
+
+    def get(self, source_hash, fmt, destination):
+        """Place a cached conversion at `destination`; returns False on a miss"""
+        entry = self.entry(source_hash, fmt)
+        try:
+            link_or_copy(entry, destination)
+        except OSError:
+            return False
+        os.utime(entry)
+        return True
+
+    def put(self, source_hash, fmt, path):
+        entry = self.entry(source_hash, fmt)
+        temp = f"{entry}.{threading.get_ident()}.tmp"
+        try:
+            link_or_copy(path, temp)
+            os.replace(temp, entry)
+            size = os.path.getsize(entry)
+        except OSError:
+            Path(temp).unlink(missing_ok=True)
+            return
+        with self.size_lock:
+            self.size += size
+            full = self.size > self.max_bytes
+        if full:
+            self.evict(self.max_bytes * 0.9)  # with some room, so not every later put scans the directory
+
+    def entries(self):
+        """(mtime, size, path) of every entry"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def evict(self, limit=None):
+        """Delete least recently used entries until the cache fits in `limit` (default max_bytes)"""
+        limit = self.max_bytes if limit is None else limit
+        with self.size_lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= limit:
+                    break
+                Path(path).unlink(missing_ok=True)
+                total -= size
+            self.size = total
+
+class ScratchDir:
+    """Per-run directory for conversion output, on local disk or tmpfs rather than the library
+
+    Each run holds an flock on its directory. Directories whose lock can be
+    taken were left by a killed run and are removed; PIDs cannot tell, since
+    they repeat across container restarts.
+    """
+
+    def __init__(self, base=None):
+        base = base or tempfile.gettempdir()
+        os.makedirs(base, exist_ok=True)
+        remove_stale_dirs(base, SCRATCH_PREFIX, require_lock=True)
+        self.path = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=base)
+        self.lock = os.open(os.path.join(self.path, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.close(self.lock)
+
+def remove_stale_dirs(base, prefix, require_lock=False):
+    """Remove directories named `prefix`* in `base` that no running process holds locked
+
+    With `require_lock`, only directories created by ScratchDir are considered,
+    since a shared temp directory may hold others with the same prefix.
+    """
+    for entry in os.scandir(base):
+        if not entry.name.startswith(prefix) or not entry.is_dir(follow_symlinks=False):
+            continue
+        lock = os.path.join(entry.path, ".lock")
+        if require_lock and not os.path.exists(lock):
+            continue
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_RDWR, 0o644)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            continue  # still in use
+        finally:
+            os.close(fd)
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def registered_paths(library, book_ids, server=None):
+    """Paths Calibre has on record for the given books: {(book_id, fmt): path}, None if unreadable"""
+    book_ids = sorted(set(book_ids))
+    if server is not None:
+        paths = {}
+        try:
+            for start in range(0, len(book_ids), SERVER_ID_CHUNK):
+                search = " or ".join(f"id:={book_id}" for book_id in book_ids[start:start + SERVER_ID_CHUNK])
+                for book in server.books(library, search):
+                    for fmt, path in book.formats.items():
+                        paths[book.id, fmt] = os.path.normpath(path)
+        except CalibreServerError:
+            return None
+        return paths
+    try:
+        conn = open_metadata_db(library)
+    except sqlite3.Error:
+        return None
+    try:
+        paths = {}
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(book_ids), 500):
+            chunk = book_ids[start:start + 500]
+            rows = conn.execute(
+                "SELECT data.book, books.path, data.format, data.name FROM data JOIN books ON books.id = data.book "
+                f"WHERE data.book IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for book_id, book_path, fmt, name in rows:
+                fmt = fmt.lower()
+                paths[book_id, fmt] = os.path.normpath(os.path.join(library, book_path, f"{name}.{fmt}"))
+        return paths
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+def publish(job, markers_dir):
+    """Move a converted file from scratch into its book folder, under the name Calibre will give it
+
+    Calibre's add_format skips its copy when the file is already at the
+    destination, so the library is written once. The file is written under a
+    temporary name and renamed, so a crash never leaves a partial EPUB, and a
+    marker in the state directory lets the next run clean up after a killed one.
+    """
+    # Calibre names every format of a book after the same data.name as the source. The folder is
+    # the source's too: when metadata.db's path was stale, the library index found where it really is
+    source = job.book.formats[job.source_format]
+    stem = Path(source).stem
+    book_dir = os.path.dirname(source)
+    for fmt, output in list(job.outputs.items()):
+        final = os.path.normpath(os.path.join(book_dir, f"{stem}.{fmt}"))
+        temp = os.path.join(book_dir, f".{stem}.{fmt}.{os.getpid()}.tmp")
+        marker = os.path.join(markers_dir, f"{job.book.id}.{fmt}.json")
+
+        with open(marker, "w") as f:
+            json.dump({"book": job.book.id, "format": fmt, "temp": temp, "path": final}, f)
+        job.markers.append(marker)
+        try:
+            try:
+                # Same filesystem: no copy at all. A file shared with the cache must not end up
+                # in the library, where Calibre may rewrite it in place
+                if os.stat(output).st_nlink > 1:
+                    raise OSError("shared with the conversion cache")
+                os.rename(output, temp)
+            except OSError:
+                shutil.copyfile(output, temp)
+            fd = os.open(temp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(temp, final)
+        except OSError:
+            Path(temp).unlink(missing_ok=True)
+            raise
+        Path(output).unlink(missing_ok=True)
+        job.outputs[fmt] = final
+
+def recover_published(library, markers_dir, keep=(), server=None):
+    """Remove what killed runs left in book folders: temporary files and EPUBs never registered
+
+    Markers in `keep` belong to outputs the journal resumes registering.
+    """
+    entries = []
+    for marker in Path(markers_dir).glob("*.json"):
+        if str(marker) in keep:
+            continue
+        try:
+            entries.append((marker, json.loads(marker.read_text())))
+        except (OSError, ValueError):
+            marker.unlink(missing_ok=True)
+    if not entries:
+        return
+
+    registered = registered_paths(library, [entry["book"] for _, entry in entries], server)
+    removed = 0
+    for marker, entry in entries:
+        leftovers = [entry["temp"]]
+        # Only when Calibre's records are readable: never delete a file it may have on record
+        if registered is not None and registered.get((entry["book"], entry["format"])) != entry["path"]:
+            leftovers.append(entry["path"])
+        for path in leftovers:
+            if os.path.exists(path):
+                Path(path).unlink(missing_ok=True)
+                removed += 1
+        marker.unlink(missing_ok=True)
+    if removed:
+        print(f"🧹 Removed {removed} files left in the library by an interrupted run")
+
+class Journal:
+    """Append-only, fsync'd record of each job's way through a pass, so a killed run can resume
+
+    One JSON object per line in <state dir>/journal.jsonl:
+
+      planned     books discovery found to convert (a window at a time)
+      converting  a conversion started
+      converted   outputs published into the book folder, not registered yet
+      registered  the book's formats were added; carries its state store record
+      failed      the book failed; carries its state store record
+
+    A pass that finishes empties the journal. After an OOM kill or a reboot,
+    resume() replays it: outcomes the state store had not committed are
+    recorded, published outputs are registered instead of converted again, and
+    books that were only planned or converting are looked at again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.failed = False
+
+    @classmethod
+    def open(cls, state_dir):
+        try:
+            return cls(os.path.join(state_dir, JOURNAL_NAME))
+        except OSError as e:
+            print(f"⚠️  Cannot keep a work journal ({e}); an interrupted run will start over")
+            return None
+
+    def append(self, event, **fields):
+        line = json.dumps({"event": event, **fields}) + "\n"
+        with self.lock:
+            try:
+                os.write(self.fd, line.encode())
+                os.fsync(self.fd)
+            except OSError as e:
+                # Conversions go on; a crash now would only cost repeated work
+                if not self.failed:
+                    print(f"⚠️  Cannot write the work journal ({e})")
+                self.failed = True
+
+    def converted(self, job):
+        self.append(
+            "converted", book=job.book.id, path=job.book.path, source_format=job.source_format,
+            signature=job.signature, outputs=job.outputs, duration=job.duration, reused=job.reused,
+            attempts=job.attempts, timeouts=job.timeouts
         )
-        if success and stdout.strip():
-            source_path = stdout.strip().split('\n')[0]
+
+    def outcome(self, job, status, **fields):
+        """Log what was recorded in the state store for a finished job"""
+        record = {"status": status, "source_format": job.source_format, "signature": job.signature, **fields}
+        self.append("registered" if status == "converted" else "failed", book=job.book.id, state=record)
+
+    def entries(self):
+        entries = []
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass  # torn write of a killed run
+        except OSError:
+            pass
+        return entries
+
+    def rewrite(self, lines):
+        """Atomically replace the journal with `lines` (JSON objects)"""
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            os.replace(temporary, self.path)
+            os.close(self.fd)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def resume(self, state, markers_dir):
+        """Replay an interrupted pass; returns (published jobs to register, IDs of books to look at again)"""
+        latest = {}
+        for entry in self.entries():
+            for book_id in entry.get("books") or [entry.get("book")]:
+                latest[book_id] = entry
+
+        jobs = []
+        again = []
+        for book_id, entry in latest.items():
+            if entry["event"] in ("registered", "failed"):
+                state.record(book_id, **entry["state"])
+            elif entry["event"] == "converted" and all(os.path.exists(path) for path in entry["outputs"].values()):
+                job = Job(
+                    Book(book_id, entry["path"]), entry["source_format"], tuple(entry["signature"]),
+                    targets=list(entry["outputs"]), outputs=entry["outputs"], duration=entry["duration"],
+                    reused=entry["reused"], attempts=entry["attempts"], timeouts=entry["timeouts"],
+                    markers=[os.path.join(markers_dir, f"{book_id}.{fmt}.json") for fmt in entry["outputs"]]
+                )
+                jobs.append(job)
+            elif book_id is not None:
+                again.append(book_id)
+        state.commit()
+        # Outcomes are in the state store now; only the outputs still to be registered carry over
+        with contextlib.suppress(OSError):
+            self.rewrite([latest[job.book.id] for job in jobs])
+        return jobs, again
+
+    def close(self, finished=False):
+        """Close the journal, emptying it if the pass finished and its outcomes are committed"""
+        if finished:
+            with contextlib.suppress(OSError):
+                self.rewrite([])
+        os.close(self.fd)
+
+# Output formats Calibre turned out not to support in this process (see UNSUPPORTED_OUTPUT)
+UNAVAILABLE_TARGETS = set()
+PROBED_TARGETS = set()
+
+def probe_targets(targets, scratch_dir=None):
+    """Check once per process that Calibre can write plugin-provided target formats (e.g. kepub)"""
+    for fmt in targets:
+        if fmt in BUILTIN_OUTPUTS or fmt in PROBED_TARGETS:
+            continue
+        PROBED_TARGETS.add(fmt)
+        with tempfile.TemporaryDirectory(prefix=SCRATCH_PREFIX + "probe-", dir=scratch_dir) as probe:
+            source = os.path.join(probe, "probe.txt")
+            with open(source, "w") as f:
+                f.write("Probe\n")
+            success, stdout, stderr = run_command(["ebook-convert", source, os.path.join(probe, f"probe.{fmt}")],
+                                                  timeout=MIN_TIMEOUT)
+        if not success and UNSUPPORTED_OUTPUT in stdout + stderr:
+            UNAVAILABLE_TARGETS.add(fmt)
+            print(f"⚠️  Calibre cannot write {fmt} (output plugin missing); it will not be converted")
+
+def convert_to(job, source, fmt, scratch_dir, warm=None, cache=None, profiler=None, profile=DEFAULT_PROFILE):
+    """One step of a book's pipeline; returns (success, error, reused)"""
+    output = os.path.join(scratch_dir, f"{job.book.id}.{fmt}")
+    options = profile_options(profile, source)
+    reused = False
+
+    def convert():
+        if profiler is None:
+            return run_ebook_convert(source, output, warm, job.timeout, options=options)
+        return profiler.convert(job, source, output, fmt, warm, options)
+
+    if cache is None:
+        success, error = convert()
+    else:
+        # Every output is keyed by the original source, so derived formats are cached too;
+        # other profiles than the default keep their own copies
+        key = fmt if profile == DEFAULT_PROFILE else f"{fmt}.{profile}"
+        with cache.lock(job.source_hash):
+            reused = cache.get(job.source_hash, key, output)
+            if reused:
+                success, error = True, ""
+            else:
+                success, error = convert()
+                if success:
+                    cache.put(job.source_hash, key, output)
+    if success:
+        job.outputs[fmt] = output
+    return success, error, reused
+
+def convert_book(job, scratch_dir, index=None, warm=None, cache=None, profiler=None, profile=DEFAULT_PROFILE):
+    """Convert a book into its missing formats in the scratch directory; publishing and registration come after
+
+    The first target is converted from the source. Once the EPUB exists, the
+    other targets are converted from it, which is much cheaper than decoding a
+    MOBI or DJVU again.
+    """
+    book_id = job.book.id
+    source_format = job.source_format
+    source_path = job.book.formats.get(source_format)
+
+    if (not source_path or not Path(source_path).exists()) and index is not None:
+        # Path from metadata.db is stale; look the file up on disk instead
+        source_path = index.lookup(book_id, source_format)
 
     if not source_path or not Path(source_path).exists():
         return False, f"Source file not found for {source_format}"
+    job.book.formats[source_format] = source_path  # publish() puts the outputs next to it
+
+    if cache is not None:
+        job.source_hash = hash_file(source_path)
+        if profile_options(profile, source_path) == NATIVE_BUILD:
+            # build_epub() takes the title and author from the book's folder, so an identical
+            # file in another book only shares the EPUB (and formats derived from it) under the same names
+            names = "\0".join(book_names(source_path)).encode()
+            job.source_hash = hashlib.blake2b(job.source_hash.encode() + b"\0" + names, digest_size=32).hexdigest()
 
-    # Create output path
-    source_obj = Path(source_path)
-    output_path = source_obj.parent / f"{source_obj.stem}.{target_format}"
+    base = source_path
+    job.reused = True
+    for fmt in job.targets:
+        if fmt in UNAVAILABLE_TARGETS:
+            continue
+        started = time.monotonic()
+        success, error, reused = convert_to(job, base, fmt, scratch_dir, warm, cache, profiler, profile)
+        if not success and UNSUPPORTED_OUTPUT in error:
+            # A missing output plugin is a setup problem, not a bad book: stop trying this format
+            if fmt not in UNAVAILABLE_TARGETS:
+                UNAVAILABLE_TARGETS.add(fmt)
+                print(f"⚠️  Calibre cannot write {fmt} (output plugin missing); skipping it from now on")
+            continue
+        if not success:
+            job.timed_out = error == TIMEOUT_MESSAGE
+            if job.timed_out:
+                TIMEOUTS_TOTAL.inc(format=source_format)
+                error = f"{TIMEOUT_MESSAGE} after {format_duration(job.timeout)}"
+            return False, f"Conversion to {fmt} failed: {error}"
 
-    # Convert using ebook-convert
-    cmd = f"ebook-convert '{source_path}' '{output_path}'"
-    success, stdout, stderr = run_command(cmd)
+        job.reused = job.reused and reused
+        if not reused:
+            elapsed = time.monotonic() - started
+            if isinstance(warm, RemoteQueue) and job.outputs[fmt] in warm.timings:
+                # A worker converted it and observed CONVERSION_SECONDS; time in the queue and in transfers
+                # is not conversion time, for the metric or for the cost rates
+                elapsed = warm.timings.pop(job.outputs[fmt]) or elapsed
+            else:
+                CONVERSION_SECONDS.observe(elapsed, format=Path(base).suffix.lstrip(".").lower())
+            if base == source_path and job.duration is None:
+                # Cost rates are per source format, so only the conversion from the source counts
+                job.duration = elapsed
+        if fmt == DERIVE_FROM:
+            base = job.outputs[fmt]
 
+    if not job.outputs:
+        job.reused = False
+        return False, f"No target format could be produced ({', '.join(job.targets)} unavailable)"
+    return True, f"Converted {source_format} → {', '.join(job.outputs)}"
+
+def convert_and_publish(job, scratch_dir, markers_dir, index=None, warm=None, cache=None, profiler=None,
+                        profile=DEFAULT_PROFILE):
+    """Convert a book in scratch and publish it into its book folder, ready for the Registrar"""
+    success, message = convert_book(job, scratch_dir, index, warm, cache, profiler, profile)
     if not success:
-        return False, f"Conversion failed: {stderr}"
+        return success, message
+    try:
+        publish(job, markers_dir)
+    except OSError as e:
+        for path in [*job.outputs.values(), *job.markers]:
+            Path(path).unlink(missing_ok=True)
+        return False, f"Cannot publish to library: {e}"
+    return success, message
 
-    # Add converted format to library
-    success, stdout, stderr = run_command(
-        f"calibredb add_format --library-path {CALIBRE_LIBRARY} {book_id} '{output_path}'"
-    )
+# Runs inside calibre-debug: adds a batch of formats through one library connection.
+# Results are printed after a marker because Calibre may write its own output to stdout.
+REGISTER_CODE = r"""
+import json, sys, time
+from calibre.library import db
+batch = json.load(sys.stdin)
+library = db(batch["library"])
+api = library.new_api
+results = []
+for book_id, fmt, path in batch["formats"]:
+    for attempt in range(batch["retries"]):
+        try:
+            results.append([bool(api.add_format(book_id, fmt, path, run_hooks=False)), ""])
+            break
+        except Exception as e:
+            if "locked" in str(e) and attempt + 1 < batch["retries"]:
+                time.sleep(2 ** attempt)
+                continue
+            results.append([False, str(e)])
+            break
+library.close()
+print("CONVERTER-RESULTS " + json.dumps(results))
+"""
 
-    if success:
-        # Optionally remove the converted file from disk (Calibre copies it)
+class Registrar:
+    """The single writer that adds converted formats to the library
+
+    Staged jobs are collected by one writer thread and flushed in batches: one
+    calibre-debug process opens the library once and adds every format in the
+    batch, instead of one calibredb process (and one library lock round-trip)
+    per book. Without calibre-debug each book falls back to its own calibredb
+    add_format call. With a Calibre content server, every format is uploaded
+    to it over one kept-alive connection instead, and the server, which holds
+    the library open, writes it. Conversions keep running while a batch is
+    written.
+    """
+
+    def __init__(self, library, batch_size=DEFAULT_REGISTER_BATCH, max_delay=REGISTER_MAX_DELAY, server=None):
+        self.library = library
+        self.server = server
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.use_api = True
+        self.incoming = queue.Queue()
+        self.outcomes = queue.Queue()
+        self.writer = threading.Thread(target=self.run, name="registrar", daemon=True)
+        self.writer.start()
+
+    def add(self, job):
+        self.incoming.put(job)
+
+    def results(self):
+        """Outcomes registered since the last call: [(job, success, message)]"""
+        outcomes = []
+        while True:
+            try:
+                outcomes.append(self.outcomes.get_nowait())
+            except queue.Empty:
+                return outcomes
+
+    def close(self):
+        """Flush whatever is still pending and return the remaining outcomes"""
+        self.incoming.put(None)
+        self.writer.join()
+        return self.results()
+
+    def run(self):
+        batch = []
+        deadline = None
+        closing = False
+        while not closing:
+            timeout = None if not batch else max(0, deadline - time.monotonic())
+            try:
+                job = self.incoming.get(timeout=timeout)
+            except queue.Empty:
+                job = False
+            if job is None:
+                closing = True
+            elif job:
+                if not batch:
+                    deadline = time.monotonic() + self.max_delay
+                batch.append(job)
+            if batch and (closing or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                for outcome in self.flush(batch):
+                    self.outcomes.put(outcome)
+                batch = []
+
+    def flush(self, batch):
+        """Register a batch of jobs; returns [(job, success, message)]
+
+        A job succeeds when every one of its formats was added.
+        """
+        formats = [(job, fmt, path) for job in batch for fmt, path in job.outputs.items()]
         try:
-            Path(output_path).unlink(missing_ok=True)
-        except:
-            pass
-        return True, f"Converted {source_format} → {target_format}"
-    else:
-        return False, f"Failed to add format to library: {stderr}"
+            if self.server is not None:
+                results = [self.register_with_server(job, fmt, path) for job, fmt, path in formats]
+            else:
+                results = self.register_with_api(formats) if self.use_api else None
+            if results is None:
+                results = [self.register_with_calibredb(job, path) for job, fmt, path in formats]
+        except Exception as e:
+            results = [(False, str(e))] * len(formats)
 
-def main():
-    print("🔄 Calibre Library Converter - Starting...")
-    print(f"Library: {CALIBRE_LIBRARY}")
-    print(f"Target format: {CONVERT_TO}")
-    print("-" * 50)
+        # Calibre keeps a published file in place unless it names the format differently;
+        # then it made its own copy, and ours would be an orphan
+        registered = registered_paths(self.library, [job.book.id for job in batch], self.server)
+        errors = {}
+        for (job, fmt, path), (success, error) in zip(formats, results):
+            if not success or (registered is not None and registered.get((job.book.id, fmt)) != path):
+                Path(path).unlink(missing_ok=True)
+            if not success:
+                errors.setdefault(id(job), f"{fmt}: {error}")
 
-    books = get_all_books()
-    print(f"📚 Found {len(books)} books in library")
+        outcomes = []
+        for job in batch:
+            for marker in job.markers:
+                Path(marker).unlink(missing_ok=True)
+            targets = ", ".join(job.outputs)
+            if id(job) in errors:
+                outcomes.append((job, False, f"Failed to add format to library: {errors[id(job)]}"))
+            elif job.reused:
+                outcomes.append((job, True, f"Reused conversion of an identical {job.source_format} → {targets}"))
+            else:
+                outcomes.append((job, True, f"Converted {job.source_format} → {targets}"))
+        return outcomes
 
-    converted = 0
-    skipped = 0
-    errors = 0
+    def register_with_api(self, formats):
+        """Add a batch of [(job, format, path)] through Calibre's library API; None if calibre-debug is unusable"""
+        request = {
+            "library": self.library,
+            "retries": REGISTER_LOCK_RETRIES,
+            "formats": [[job.book.id, fmt.upper(), path] for job, fmt, path in formats],
+        }
+        with CALIBREDB_SECONDS.time(command="register_batch"):
+            success, stdout, stderr = run_command(
+                ["calibre-debug", "-c", REGISTER_CODE],
+                timeout=300 + 30 * len(formats),
+                input=json.dumps(request)
+            )
+        for line in reversed(stdout.splitlines()):
+            if line.startswith("CONVERTER-RESULTS "):
+                return json.loads(line.split(" ", 1)[1])
+        if "No such file" in stderr:
+            print("⚠️  calibre-debug unavailable; registering formats with calibredb one by one")
+            self.use_api = False
+        else:
+            print(f"⚠️  Batch registration failed ({stderr.strip()[-200:]}); retrying with calibredb")
+        return None
+
+    def register_with_server(self, job, fmt, path):
+        """Add one format through the Calibre content server"""
+        with CALIBREDB_SECONDS.time(command="server_add_format"):
+            try:
+                return self.server.add_format(job.book.id, fmt, path), ""
+            except (CalibreServerError, OSError) as e:
+                return False, str(e)
+
+    def register_with_calibredb(self, job, path):
+        """Add one format with calibredb, retrying while the library is locked"""
+        for attempt in range(REGISTER_LOCK_RETRIES):
+            with CALIBREDB_SECONDS.time(command="add_format"):
+                success, stdout, stderr = run_command(
+                    ["calibredb", "add_format", "--library-path", self.library, str(job.book.id), path]
+                )
+            if success or "locked" not in stderr or attempt + 1 == REGISTER_LOCK_RETRIES:
+                return success, stderr
+            time.sleep(2 ** attempt)
+
+class RedisError(Exception):
+    """Error reply from Redis"""
+
+class RedisClient:
+    """Minimal RESP client for distributed mode, so the Calibre image needs no redis-py
+
+    One connection per client and no pipelining, so use one client per thread.
+    Files are streamed to and from Redis instead of being read into memory.
+    """
+
+    def __init__(self, url, password=None, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"unsupported Redis URL {url!r} (use redis://[:password@]host[:port][/db])")
+        self.address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self.password = password or (urllib.parse.unquote(parsed.password) if parsed.password else None)
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.sock.makefile("rb")
+        if self.password:
+            self.execute("AUTH", self.password)
+        if self.db:
+            self.execute("SELECT", self.db)
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = self.reader = None
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Connect on first use; drop the connection on I/O errors so the next call reconnects"""
+        if self.sock is None:
+            self.connect()
+        self.sock.settimeout(timeout or self.timeout)
+        try:
+            yield self.sock
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def bulk(*args):
+        """Encode command arguments as RESP bulk strings"""
+        parts = []
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Redis closed the connection")
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self.read_reply() for _ in range(count)]
+        raise ConnectionError(f"unexpected reply from Redis: {line[:40]!r}")
+
+    def execute(self, *args, block=0):
+        """Run one command; `block` is the server-side timeout of a blocking command"""
+        with self.connection(self.timeout + block) as sock:
+            sock.sendall(b"*%d\r\n" % len(args) + self.bulk(*args))
+            return self.read_reply()
+
+    def set_file(self, key, path, ttl):
+        """SET key to the contents of a file, expiring after `ttl` seconds"""
+        with open(path, "rb") as f, self.connection() as sock:
+            size = os.fstat(f.fileno()).st_size
+            # SET key <file> EX ttl, with the value sent straight from the file
+            sock.sendall(b"*5\r\n" + self.bulk("SET", key) + b"$%d\r\n" % size)
+            sock.sendfile(f)
+            sock.sendall(b"\r\n" + self.bulk("EX", ttl))
+            return self.read_reply()
+
+    def get_to_file(self, key, path):
+        """Write the value of key to a file; False if the key does not exist"""
+        with self.connection() as sock:
+            sock.sendall(b"*2\r\n" + self.bulk("GET", key))
+            line = self.reader.readline()
+            if line.startswith(b"-"):
+                raise RedisError(line[1:].decode().strip())
+            if not line.startswith(b"$"):
+                raise ConnectionError(f"unexpected reply from Redis: {line[:40]!r}")
+            remaining = int(line[1:])
+            if remaining < 0:
+                return False
+            with open(path, "wb") as f:
+                while remaining:
+                    chunk = self.reader.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ConnectionError("Redis closed the connection")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            self.reader.read(2)
+            return True
+
+def redis_key(*parts):
+    return ":".join([REDIS_PREFIX, *map(str, parts)])
+
+def redis_address(url):
+    """host:port of a Redis URL, without the password"""
+    parsed = urllib.parse.urlsplit(url)
+    return f"{parsed.hostname or 'localhost'}:{parsed.port or 6379}"
+
+def read_password_file(path):
+    """Read a password from a Docker secret file, or None"""
+    if not path:
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+class RemoteQueue:
+    """Coordinator side of distributed mode: hands conversions to worker replicas through Redis
+
+    It stands in for a WarmWorkerPool, so run_pass keeps its cost ordering,
+    runtime budget and single Registrar writer; only ebook-convert moves to the
+    workers. Each job is a hash with its source file next to it. Workers move
+    job IDs from the queue to a processing list and hold a lease on them, which
+    they renew with heartbeats. A job whose lease expires is requeued, up to
+    MAX_REQUEUES times. convert() returns None, so the book is converted
+    locally, for sources too big for Redis and while no worker is alive.
+    """
+
+    def __init__(self, url, password=None):
+        self.url = url
+        self.password = password
+        self.clients = threading.local()
+        self.run = uuid.uuid4().hex[:12]
+        self.waiters = {}  # job ID -> [Event, result]
+        self.requeues = collections.Counter()
+        self.unleased = {}  # job ID -> when it was first seen claimed but without a lease
+        self.uploads = threading.Condition()
+        self.uploaded = 0  # bytes of in-flight sources stored in Redis
+        self.timings = {}  # output path -> seconds the worker spent converting it, None if it did not say
+        self.closed = threading.Event()
+
+        redis = self.redis()
+        # Jobs of an earlier coordinator died with it; their keys expire on their own
+        redis.execute("DEL", redis_key("queue"), redis_key("processing"), redis_key("leases"))
+        self.collector = threading.Thread(target=self.collect, name="remote-queue", daemon=True)
+        self.collector.start()
+
+    def redis(self):
+        """Redis client of the calling thread"""
+        client = getattr(self.clients, "client", None)
+        if client is None:
+            client = self.clients.client = RedisClient(self.url, self.password)
+        return client
+
+    @property
+    def in_flight(self):
+        """Conversions handed to workers and not yet returned"""
+        return len(self.waiters)
+
+    @property
+    def available(self):
+        """True while at least one worker has checked in recently"""
+        try:
+            return self.redis().execute("ZCOUNT", redis_key("workers"), time.time() - LEASE_SECONDS, "+inf") > 0
+        except (OSError, RedisError):
+            return False
+
+    def convert(self, source, output, timeout, log=None, timer=None, options=()):
+        """Convert on a worker; None means convert locally instead
+
+        Workers do not send Calibre's output back, so `log` and `timer` are unused.
+        """
+        size = os.path.getsize(source)
+        if size > MAX_REMOTE_SOURCE:
+            return None
+        with self.uploads:
+            # Keep the copies of in-flight sources well inside Redis' memory limit
+            while self.uploaded and self.uploaded + size > REMOTE_BYTES_IN_FLIGHT:
+                self.uploads.wait()
+            self.uploaded += size
+
+        job_id = uuid.uuid4().hex
+        waiter = self.waiters[job_id] = [threading.Event(), None]
+        redis = self.redis()
+        try:
+            redis.execute(
+                "HSET", redis_key("job", job_id), "run", self.run, "timeout", timeout,
+                "source", os.path.basename(source), "output", os.path.basename(output),
+                "options", json.dumps(list(options))
+            )
+            redis.execute("EXPIRE", redis_key("job", job_id), REDIS_KEY_TTL)
+            redis.set_file(redis_key("source", job_id), source, REDIS_KEY_TTL)
+            redis.execute("RPUSH", redis_key("queue"), job_id)
+            while not waiter[0].wait(HEARTBEAT_INTERVAL):
+                # Every worker is gone: take the job back while nobody has claimed it
+                if not self.available and redis.execute("LREM", redis_key("queue"), 0, job_id):
+                    return None
+            success, error, output_key = waiter[1][:3]
+            if success and not redis.get_to_file(output_key, output):
+                return False, "Converted file expired in Redis"
+            if success:
+                self.timings[str(output)] = waiter[1][3]
+            return success, error
+        except (OSError, RedisError) as e:
+            print(f"⚠️  Redis unavailable ({e}); converting locally")
+            return None
+        finally:
+            self.waiters.pop(job_id, None)
+            self.requeues.pop(job_id, None)
+            with self.uploads:
+                self.uploaded -= size
+                self.uploads.notify_all()
+            with contextlib.suppress(OSError, RedisError):
+                keys = [redis_key("job", job_id), redis_key("source", job_id)]
+                if waiter[1] and waiter[1][2]:
+                    keys.append(waiter[1][2])
+                redis.execute("DEL", *keys)
+
+    def collect(self):
+        """Deliver worker results to the waiting threads and requeue jobs of dead workers"""
+        redis = self.redis()
+        reaped = time.monotonic()
+        while not self.closed.is_set():
+            try:
+                reply = redis.execute("BLPOP", redis_key("done", self.run), 1, block=1)
+                if reply:
+                    self.deliver(redis, json.loads(reply[1]))
+                if time.monotonic() - reaped >= HEARTBEAT_INTERVAL:
+                    self.reap(redis)
+                    reaped = time.monotonic()
+            except (OSError, RedisError, ValueError) as e:
+                print(f"⚠️  Redis unavailable ({e})")
+                self.closed.wait(5)
+
+    def deliver(self, redis, result):
+        job_id = result["id"]
+        redis.execute("ZREM", redis_key("leases"), job_id)
+        redis.execute("LREM", redis_key("processing"), 0, job_id)
+        waiter = self.waiters.get(job_id)
+        if waiter is None or waiter[0].is_set():
+            # A worker whose lease expired finished after all; someone else's result was used
+            if result.get("output"):
+                redis.execute("DEL", result["output"])
+            return
+        # A requeued copy of the job may still be waiting for a worker
+        redis.execute("LREM", redis_key("queue"), 0, job_id)
+        waiter[1] = (result["success"], result["error"], result.get("output"), result.get("seconds"))
+        waiter[0].set()
+
+    def reap(self, redis):
+        now = time.time()
+        for job_id in redis.execute("ZRANGEBYSCORE", redis_key("leases"), "-inf", now):
+            self.requeue(redis, job_id.decode(), "worker stopped sending heartbeats")
+        # A worker that died between claiming a job and taking its lease leaves it without one
+        for job_id in redis.execute("LRANGE", redis_key("processing"), 0, -1):
+            job_id = job_id.decode()
+            if redis.execute("ZSCORE", redis_key("leases"), job_id) is not None:
+                self.unleased.pop(job_id, None)
+            elif now - self.unleased.setdefault(job_id, now) > LEASE_SECONDS:
+                del self.unleased[job_id]
+                self.requeue(redis, job_id, "worker died while claiming it")
+
+    def requeue(self, redis, job_id, reason):
+        redis.execute("ZREM", redis_key("leases"), job_id)
+        if not redis.execute("LREM", redis_key("processing"), 0, job_id):
+            return
+        waiter = self.waiters.get(job_id)
+        if waiter is None or waiter[0].is_set():
+            return
+        self.requeues[job_id] += 1
+        if self.requeues[job_id] > MAX_REQUEUES:
+            # Requeued MAX_REQUEUES times, and lost once more
+            waiter[1] = (False, f"Lost by {self.requeues[job_id]} workers ({reason})", None, None)
+            waiter[0].set()
+            return
+        print(f"\n🔁 Requeued remote job {job_id[:8]}: {reason}")
+        redis.execute("LPUSH", redis_key("queue"), job_id)
+
+    def close(self):
+        self.closed.set()
+        self.collector.join()
+
+class RemoteWorker:
+    """Worker side of distributed mode: converts jobs from Redis until stopped
+
+    Each slot claims one job at a time; the main thread checks the worker in and
+    renews the leases of running jobs. On shutdown, unfinished jobs go back to
+    the front of the queue instead of waiting for their leases to expire.
+    """
+
+    def __init__(self, url, password=None, slots=1, warm=None, scratch_dir=None, pressure=None, status_file=None):
+        self.url = url
+        self.password = password
+        self.slots = slots
+        self.warm = warm
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self.scratch = ScratchDir(scratch_dir)
+        self.running = {}  # slot -> job ID
+        self.governor = MemoryGovernor.open()
+        self.pressure = pressure or HostPressure(slots)
+        self.stop = threading.Event()
+        self.status_file = status_file
+
+    def run(self):
+        for slot in range(self.slots):
+            threading.Thread(target=self.work, args=(slot,), name=f"slot-{slot}", daemon=True).start()
+        redis = RedisClient(self.url, self.password)
+        PROGRESS.begin(self.slots, None, state="working")  # the coordinator knows what is left
+        print(f"🛠️  Worker {self.name} converting with {self.slots} slots")
+        try:
+            while True:
+                try:
+                    now = time.time()
+                    redis.execute("ZADD", redis_key("workers"), now, self.name)
+                    for job_id in list(self.running.values()):
+                        redis.execute("ZADD", redis_key("leases"), "XX", now + LEASE_SECONDS, job_id)
+                except (OSError, RedisError) as e:
+                    print(f"⚠️  Redis unavailable ({e})")
+                if self.status_file:
+                    write_status_file(self.status_file)
+                time.sleep(HEARTBEAT_INTERVAL)
+        finally:
+            self.stop.set()
+            with contextlib.suppress(OSError, RedisError):
+                for job_id in list(self.running.values()):
+                    redis.execute("ZREM", redis_key("leases"), job_id)
+                    if redis.execute("LREM", redis_key("processing"), 0, job_id):
+                        redis.execute("LPUSH", redis_key("queue"), job_id)
+                redis.execute("ZREM", redis_key("workers"), self.name)
+            if self.warm is not None:
+                self.warm.close()
+            self.scratch.close()
+
+    def work(self, slot):
+        redis = RedisClient(self.url, self.password)
+        while not self.stop.is_set():
+            # Claim a job only if this slot is open given the node's load and the job fits in memory
+            # next to the ones the other slots are converting
+            self.governor.sample()
+            if slot >= self.pressure.update() or not self.governor.can_start(len(self.running)):
+                self.stop.wait(1)
+                continue
+            try:
+                job_id = redis.execute(
+                    "BLMOVE", redis_key("queue"), redis_key("processing"), "LEFT", "RIGHT", 5, block=5
+                )
+                if job_id is not None:
+                    self.process(redis, slot, job_id.decode())
+            except (OSError, RedisError) as e:
+                print(f"⚠️  Redis unavailable ({e})")
+                self.stop.wait(5)
+
+    def process(self, redis, slot, job_id):
+        redis.execute("ZADD", redis_key("leases"), time.time() + LEASE_SECONDS, job_id)
+        self.running[slot] = job_id
+        source = output = outcome = None
+        try:
+            fields = redis.execute("HGETALL", redis_key("job", job_id))
+            job = {k.decode(): v.decode() for k, v in zip(fields[::2], fields[1::2])}
+            if not job:
+                # Left over from a coordinator that has gone away
+                redis.execute("ZREM", redis_key("leases"), job_id)
+                redis.execute("LREM", redis_key("processing"), 0, job_id)
+                return
+            claim = redis.execute("HINCRBY", redis_key("job", job_id), "claims", 1)
+            source = os.path.join(self.scratch.path, f"{slot}-{job['source']}")
+            output = os.path.join(self.scratch.path, f"{slot}-{job['output']}")
+            result = {"id": job_id, "worker": self.name, "success": False, "error": "", "output": None}
+
+            print(f"\n📖 {job['source']}")
+            PROGRESS.converting(slot, slot=slot, source=job["source"], output=job["output"])
+            outcome = "failed"
+            if not redis.get_to_file(redis_key("source", job_id), source):
+                result["error"] = "Source file expired in Redis"
+            else:
+                started = time.monotonic()
+                result["success"], result["error"] = run_ebook_convert(
+                    source, output, self.warm, float(job["timeout"]), options=json.loads(job.get("options", "[]"))
+                )
+                result["seconds"] = time.monotonic() - started
+            if result["success"]:
+                outcome = "converted"
+                result["output"] = redis_key("output", job_id, claim)
+                redis.set_file(result["output"], output, REDIS_KEY_TTL)
+                # Only the worker observes remote conversions; the coordinator's wait includes queueing and transfers
+                CONVERSION_SECONDS.observe(result["seconds"], format=Path(source).suffix.lstrip(".").lower())
+                print(f"   ✅ Converted in {format_duration(result['seconds'])}")
+            else:
+                print(f"   ❌ {result['error'].strip()[-200:]}")
+            done = redis_key("done", job["run"])
+            redis.execute("RPUSH", done, json.dumps(result))
+            redis.execute("EXPIRE", done, REDIS_KEY_TTL)
+        finally:
+            self.running.pop(slot, None)
+            if outcome is not None:
+                PROGRESS.done(slot, outcome)
+            for path in (source, output):
+                if path:
+                    Path(path).unlink(missing_ok=True)
 
-    for book_id, formats in books:
-        # Check if already has EPUB
-        if formats and CONVERT_TO.lower() in formats.lower():
-            skipped += 1
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Reports changes to metadata.db using Linux inotify on the library directory"""
+
+    def __init__(self, library):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(library), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {library}")
+
+    def wait(self, timeout):
+        """Return True if metadata.db changed within `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                if name in WATCH_FILES:
+                    return True
+
+class PollWatcher:
+    """Reports changes by polling the newest books.last_modified in metadata.db (or on the Calibre server)"""
+
+    def __init__(self, library, interval=DEFAULT_POLL_INTERVAL, server=None):
+        self.library = library
+        self.interval = interval
+        self.server = server
+        self.last_seen = self.newest_change()
+
+    def newest_change(self):
+        if self.server is not None:
+            try:
+                return self.server.newest_change()
+            except CalibreServerError:
+                return None
+        try:
+            conn = open_metadata_db(self.library)
+            try:
+                return conn.execute("SELECT MAX(last_modified), COUNT(*) FROM books").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+
+    def wait(self, timeout):
+        """Return True if metadata.db changed within `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(0, min(self.interval, deadline - time.monotonic())))
+            current = self.newest_change()
+            if current != self.last_seen:
+                self.last_seen = current
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+def make_watcher(library, poll_interval, server=None):
+    """Prefer inotify; fall back to polling metadata.db, or the Calibre server"""
+    try:
+        watcher = InotifyWatcher(library)
+        print("👀 Watching metadata.db with inotify")
+        return watcher
+    except (OSError, AttributeError) as e:
+        polled = "the Calibre server" if server is not None else "metadata.db"
+        print(f"👀 inotify unavailable ({e}); polling {polled} every {poll_interval}s")
+        return PollWatcher(library, poll_interval, server)
+
+def retries_due(state_dir):
+    """True when a failed or carried-over book is due to be tried again"""
+    if not os.path.exists(os.path.join(state_dir, "state.db")):
+        return False
+    state = StateStore.open(state_dir)
+    try:
+        return bool(state.pending())
+    finally:
+        state.close()
+
+def show_quarantine(args):
+    """Print quarantined books"""
+    state = StateStore.open(args.state_dir)
+    rows = state.quarantined()
+    state.close()
+    if not rows:
+        print("✅ No books in quarantine")
+        return 0
+    print(f"🚫 {len(rows)} books in quarantine (clear with --clear-quarantine [ID ...]):")
+    for book_id, source_format, attempts, updated_at, message in rows:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(updated_at))
+        reason = " ".join((message or "").split())[:160]
+        print(f"   #{book_id:<6} {source_format or '-':<5} {attempts} attempts, last {when}: {reason}")
+    return 0
+
+def clear_quarantine(args):
+    """Release quarantined books so the next run tries them again"""
+    state = StateStore.open(args.state_dir)
+    cleared = state.clear_quarantine(args.clear_quarantine)
+    state.close()
+    print(f"🧹 Released {cleared} books from quarantine")
+    return 0
+
+def watch(args):
+    """Convert new books as they are imported until interrupted"""
+    watcher = make_watcher(args.library, args.poll_interval, args.server)
+    pressure = HostPressure.from_args(args)
+
+    # Catch up on anything imported while we were not running
+    run_pass(args, pressure)
+    while True:
+        if not watcher.wait(args.poll_interval):
+            if retries_due(args.state_dir):
+                print(f"\n🔁 Retrying failed books...")
+                run_pass(args, pressure)
             continue
 
-        # Find a convertible format
-        source_fmt = None
-        if formats:
-            available_formats = [f.strip().lower() for f in formats.split('|')]
-            for fmt in CONVERT_FROM:
-                if fmt in available_formats:
-                    source_fmt = fmt
-                    break
+        # Debounce: let a bulk import settle so it becomes one batch instead of hundreds of passes
+        first_change = time.monotonic()
+        while time.monotonic() - first_change < args.max_batch_delay:
+            if not watcher.wait(args.debounce):
+                break
+
+        print(f"\n🔔 Library changed, converting new books...")
+        run_pass(args, pressure)
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Convert Calibre library books to EPUB")
+    parser.add_argument(
+        "--library", default=CALIBRE_LIBRARY,
+        help=f"path to the Calibre library (default: {CALIBRE_LIBRARY})"
+    )
+    parser.add_argument(
+        "--with-library", metavar="URL",
+        help="read books and add formats through a running Calibre content server (http://[user@]host:8080/"
+             "[#library_id]) instead of opening metadata.db; --library is still where the book files are"
+    )
+    parser.add_argument(
+        "--server-password-file", metavar="PATH",
+        help="file holding the password of the --with-library user, e.g. a Docker secret"
+    )
+    parser.add_argument(
+        "--targets", type=parse_formats, default=[CONVERT_TO], metavar="FORMATS",
+        help=f"comma-separated formats every book should have, e.g. epub,azw3,kepub (default: {CONVERT_TO}); "
+             f"the first is converted from the source, the rest from the fresh {DERIVE_FROM.upper()}"
+    )
+    parser.add_argument(
+        "--conversion-profile", choices=sorted(CONVERSION_PROFILES), default=DEFAULT_PROFILE,
+        help=f"ebook-convert options to trade quality for speed: fast skips structure detection and font "
+             f"rescaling, quality adds heuristic processing (default: {DEFAULT_PROFILE}); workers follow the "
+             f"coordinator's"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="number of books converted in parallel (default: as many as the container's CPU quota "
+             "and memory limit allow)"
+    )
+    parser.add_argument(
+        "--warm-workers", action="store_true",
+        help="convert inside long-lived calibre-debug workers instead of one ebook-convert per book"
+    )
+    parser.add_argument(
+        "--register-batch", type=int, default=DEFAULT_REGISTER_BATCH,
+        help=f"converted books added to the library per batch (default: {DEFAULT_REGISTER_BATCH})"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB, metavar="MB",
+        help=f"size limit of the conversion cache for duplicate books, 0 disables it "
+             f"(default: {DEFAULT_CACHE_SIZE_MB}, at most {CACHE_FILESYSTEM_SHARE:.0%} of the cache's filesystem)"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="PATH",
+        help=f"where the conversion cache is kept, ideally on the same filesystem as --scratch-dir so entries "
+             f"are hard links rather than copies (default: <scratch dir>/{CACHE_DIR_NAME})"
+    )
+    parser.add_argument(
+        "--scratch-dir", metavar="PATH",
+        help="where books are converted before being published into the library, ideally local disk "
+             "or tmpfs (default: system temp directory)"
+    )
+    parser.add_argument(
+        "--state-dir",
+        help=f"where conversion outcomes are remembered between runs (default: <library>/{STATE_DIR_NAME})"
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="scan every book instead of only those changed since the last run"
+    )
+    parser.add_argument(
+        "--max-runtime", type=parse_duration, metavar="DURATION",
+        help="stop starting conversions that would not finish within this time (e.g. 6h); "
+             "the rest is carried over to the next run"
+    )
+    parser.add_argument(
+        "--max-cpu-pressure", type=float, default=DEFAULT_MAX_CPU_PRESSURE, metavar="PCT",
+        help=f"start fewer conversions while host CPU pressure (PSI some avg10) is above this, 0 to ignore it "
+             f"(default: {DEFAULT_MAX_CPU_PRESSURE})"
+    )
+    parser.add_argument(
+        "--max-io-pressure", type=float, default=DEFAULT_MAX_IO_PRESSURE, metavar="PCT",
+        help=f"start fewer conversions while host IO pressure (PSI some avg10) is above this, 0 to ignore it "
+             f"(default: {DEFAULT_MAX_IO_PRESSURE})"
+    )
+    parser.add_argument(
+        "--max-load", type=float, default=DEFAULT_MAX_LOAD, metavar="LOAD",
+        help=f"start fewer conversions while the 1-minute load average per CPU is above this, 0 to ignore it "
+             f"(default: {DEFAULT_MAX_LOAD})"
+    )
+    parser.add_argument(
+        "--redis", metavar="URL",
+        help="distributed mode: queue conversions in Redis (redis://host:6379/0) for --worker replicas; "
+             "--jobs is then the number of books handed out at once"
+    )
+    parser.add_argument(
+        "--redis-password-file", metavar="PATH",
+        help="file holding the Redis password, e.g. a Docker secret"
+    )
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="distributed mode: convert books queued in --redis by the coordinator instead of scanning a library"
+    )
+    parser.add_argument(
+        "--plan", metavar="PATH",
+        help="write the books a full pass would convert, with estimated costs and projected runtime, "
+             "to PATH (.csv for CSV, otherwise JSON) and exit without converting"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, metavar="PORT",
+        help=f"watch mode: serve Prometheus metrics on /metrics and live progress as JSON on /status "
+             f"on this port (e.g. {DEFAULT_METRICS_PORT})"
+    )
+    parser.add_argument(
+        "--metrics-textfile", metavar="PATH",
+        help="write Prometheus metrics to this file for node-exporter's textfile collector (*.prom)"
+    )
+    parser.add_argument(
+        "--status-file", metavar="PATH",
+        help=f"rewrite the /status JSON (books done and remaining, current books, throughput, ETA) "
+             f"to this file while converting (every {STATUS_FILE_INTERVAL}s; workers every {HEARTBEAT_INTERVAL}s)"
+    )
+    parser.add_argument(
+        "--profile-dir", metavar="PATH",
+        help="keep Calibre's output of every conversion in PATH/logs and write a report of the slowest books "
+             "and stages, and of calibredb versus conversion time, to PATH/report.txt"
+    )
+    parser.add_argument(
+        "--list-quarantine", action="store_true",
+        help="list books that failed too often and are no longer retried, then exit"
+    )
+    parser.add_argument(
+        "--clear-quarantine", type=int, nargs="*", metavar="ID",
+        help="release the given quarantined books (all without IDs) so they are retried, then exit"
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="keep running and convert books as soon as they are added to the library"
+    )
+    parser.add_argument(
+        "--debounce", type=float, default=DEFAULT_DEBOUNCE,
+        help=f"watch mode: seconds without library changes before converting (default: {DEFAULT_DEBOUNCE})"
+    )
+    parser.add_argument(
+        "--max-batch-delay", type=float, default=DEFAULT_MAX_BATCH_DELAY,
+        help=f"watch mode: longest a batch waits for a busy library to settle (default: {DEFAULT_MAX_BATCH_DELAY})"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+        help=f"watch mode: metadata.db polling interval without inotify (default: {DEFAULT_POLL_INTERVAL})"
+    )
+    args = parser.parse_args(argv)
+    args.jobs_source = None
+    if args.jobs is None:
+        args.jobs, args.jobs_source = auto_jobs(cgroup_dir())
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.register_batch < 1:
+        parser.error("--register-batch must be at least 1")
+    if min(args.max_cpu_pressure, args.max_io_pressure, args.max_load) < 0:
+        parser.error("--max-cpu-pressure, --max-io-pressure and --max-load cannot be negative")
+    if args.watch and args.full:
+        parser.error("--full cannot be combined with --watch")
+    if args.watch and args.max_runtime:
+        parser.error("--max-runtime cannot be combined with --watch")
+    if args.watch and args.plan:
+        parser.error("--plan cannot be combined with --watch")
+    if args.redis and not args.redis.startswith("redis://"):
+        parser.error("--redis must be a redis:// URL")
+    if args.worker and not args.redis:
+        parser.error("--worker requires --redis")
+    if args.worker and args.with_library:
+        parser.error("--worker cannot be combined with --with-library")
+    args.server = None
+    if args.with_library:
+        try:
+            args.server = CalibreServer(args.with_library, read_password_file(args.server_password_file))
+        except (ValueError, OSError) as e:
+            parser.error(f"--with-library: {e}")
+    if args.worker and (args.watch or args.full or args.plan or args.max_runtime or args.profile_dir):
+        parser.error("--worker cannot be combined with --watch, --full, --plan, --max-runtime or --profile-dir")
+    if not args.state_dir:
+        args.state_dir = os.path.join(args.library, STATE_DIR_NAME)
+    if not args.cache_dir:
+        args.cache_dir = os.path.join(args.scratch_dir or tempfile.gettempdir(), CACHE_DIR_NAME)
+    return args
+
+@dataclass
+class WorkList:
+    """Books that need converting, and why the others were left out"""
+    jobs: list = field(default_factory=list)  # in dispatch_order
+    skipped: int = 0  # already have every target format
+    unconvertible: list = field(default_factory=list)  # IDs of books without a format from CONVERT_FROM
+    waiting: int = 0  # failed before, retry not due yet
+    quarantined: int = 0
+
+def select_jobs(books, state, targets=(CONVERT_TO,), stat_sources=True, index=None):
+    """Pick the books that need converting, their source format and missing targets, sorted by estimated cost
+
+    Without `stat_sources`, file sizes come from metadata.db and only books with
+    earlier state are stat()ed, which keeps planning a large library fast. With
+    an `index`, sources missing from the path in metadata.db are looked up on disk.
+    """
+    work = WorkList()
+    now = time.time()
+    for book in books:
+        missing = [fmt for fmt in targets if fmt not in book.formats and fmt not in UNAVAILABLE_TARGETS]
+        if not missing:
+            work.skipped += 1
+            continue
+
+        # An EPUB already in the library is the cheapest source for the other targets;
+        # otherwise the first target comes from the source and the rest from the fresh EPUB
+        if DERIVE_FROM in book.formats:
+            source_fmt = DERIVE_FROM
+        else:
+            source_fmt = next((fmt for fmt in CONVERT_FROM if fmt in book.formats), None)
+        if DERIVE_FROM in missing:
+            missing.insert(0, missing.pop(missing.index(DERIVE_FROM)))
 
         if not source_fmt:
             # Book has no convertible format
+            work.unconvertible.append(book.id)
             continue
 
-        print(f"\n📖 Converting book #{book_id} ({source_fmt} → {CONVERT_TO})...")
-        success, message = convert_book(book_id, source_fmt, CONVERT_TO)
+        previous = state.get(book.id)
+        if stat_sources or previous or source_fmt not in book.sizes:
+            signature = source_signature(book.formats[source_fmt])
+            if signature == (None, None) and index is not None:
+                # Path from metadata.db is stale; find the file on disk now rather than in a conversion slot
+                found = index.lookup(book.id, source_fmt)
+                if found:
+                    book.formats[source_fmt] = found
+                    signature = source_signature(found)
+        else:
+            signature = (book.sizes[source_fmt], None)
+        attempts = timeouts = deferrals = 0
+        if previous:
+            status, *source, previous_attempts, previous_timeouts, next_attempt, previous_deferrals = previous
+            same_source = tuple(source) == (source_fmt, *signature)
+            if status == "quarantined":
+                work.quarantined += 1
+                continue
+            if same_source and status in ("failed", "pending"):
+                # Retry queue: wait out the backoff, and remember earlier attempts and timeouts, also
+                # across runs that carried the book over for --max-runtime before it could be retried
+                if status == "failed" and next_attempt and next_attempt > now:
+                    work.waiting += 1
+                    continue
+                attempts, timeouts = previous_attempts or 0, previous_timeouts or 0
+                if status == "pending":
+                    deferrals = previous_deferrals or 0
+
+        work.jobs.append(Job(book, source_fmt, signature, targets=missing, attempts=attempts, timeouts=timeouts,
+                             deferrals=deferrals))
+
+    rates = state.cost_rates()
+    for job in work.jobs:
+        job.cost = estimate_cost(job, rates)
+    work.jobs.sort(key=dispatch_order)
+    return work
+
+def dispatch_order(job):
+    """Sort key: books carried over for --max-runtime first, longest waiting first, then cheapest first
+
+    Cheapest first maximises books converted per hour and keeps one huge DJVU
+    from holding up the rest, but on its own a book too costly for what is left
+    of every run's budget would be carried over forever.
+    """
+    return -job.deferrals, job.cost
 
+class Discovery:
+    """Finds the books a pass converts on a thread of its own, while earlier ones convert
+
+    Books come from iter_books() a page at a time and are checked against the
+    state store (stat()ing their source files, and finding moved ones through
+    the library index) on this thread, which is I/O-bound while conversions
+    keep the CPU busy. Jobs reach the dispatcher cheapest first within windows
+    of up to DISCOVERY_WINDOW jobs; a smaller window is handed over whenever
+    the dispatcher has run dry. At most DISCOVERY_QUEUE windows wait, so memory
+    stays flat however large the library is. stop() ends the search early, e.g.
+    at --max-runtime; the watermark is then left alone, so the next run looks
+    at the books it did not get to.
+    """
+
+    def __init__(self, library, state_path, since=None, also=(), targets=(CONVERT_TO,), index=None,
+                 journal=None, exclude=(), server=None):
+        self.library = library
+        self.server = server
+        self.state_path = state_path
+        self.since = since
+        self.also = also
+        self.targets = targets
+        self.index = index
+        self.journal = journal
+        self.exclude = set(exclude)  # books resumed from the journal
+        self.queue = queue.Queue(maxsize=DISCOVERY_QUEUE)
+        self.ready = collections.deque()  # jobs of the window being dispatched
+        self.work = WorkList()  # counts only; jobs go through the queue
+        self.books = 0
+        self.found = 0
+        self.taken = 0
+        self.newest = None  # last_modified watermark, None if discovery failed or was stopped
+        self.error = None
+        self.finished = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="discovery", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        state = None
+        window = []
+        newest = ""
+        try:
+            # SQLite connections belong to one thread, so this one has its own
+            state = StateStore(self.state_path)
+            books = iter(iter_books(self.library, self.since, self.also, self.server))
+            while not self.stopped.is_set():
+                page = [book for _, book in zip(range(BOOK_PAGE), books)]
+                if not page:
+                    self.newest = newest or None
+                    break
+                self.books += len(page)
+                page = [book for book in page if book.id not in self.exclude]
+                newest = max([newest] + [book.last_modified for book in page if book.last_modified])
+                work = select_jobs(page, state, self.targets, index=self.index)
+                self.work.skipped += work.skipped
+                self.work.unconvertible.extend(work.unconvertible)
+                self.work.waiting += work.waiting
+                self.work.quarantined += work.quarantined
+                window.extend(work.jobs)
+                self.found += len(work.jobs)
+                if len(window) >= DISCOVERY_WINDOW or (window and self.queue.empty()):
+                    self.put(window)
+                    window = []
+        except Exception as e:
+            self.error = e
+        finally:
+            if state is not None:
+                state.close()
+            if window and not self.stopped.is_set():
+                self.put(window)
+            self.queue.put(None)
+
+    def put(self, window):
+        window.sort(key=dispatch_order)
+        if self.journal is not None:
+            self.journal.append("planned", books=[job.book.id for job in window])
+        self.queue.put(window)
+
+    def stop(self):
+        """Look for no more books; windows already handed over can still be taken"""
+        self.stopped.set()
+
+    def take(self, timeout=None):
+        """Move the next window from the queue to `ready`, waiting up to `timeout` (None: don't wait)"""
+        try:
+            window = self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+        except queue.Empty:
+            return
+        if window is None:
+            self.finished = True
+        else:
+            self.ready.extend(window)
+
+    def next(self):
+        """The next job to dispatch, or None if there is none right now"""
+        if not self.ready and not self.finished:
+            self.take()
+        if not self.ready:
+            return None
+        self.taken += 1
+        return self.ready.popleft()
+
+    def wait(self, timeout):
+        """Block up to `timeout` seconds for more jobs while nothing is converting"""
+        if self.ready or self.finished:
+            time.sleep(timeout)
+        else:
+            self.take(timeout)
+
+    @property
+    def done(self):
+        return self.finished and not self.ready
+
+    @property
+    def searching(self):
+        """Whether more books may still be found"""
+        return self.thread.is_alive()
+
+    def queued(self):
+        """Jobs found and not dispatched yet"""
+        return self.found - self.taken
+
+def project_runtime(jobs, workers, budget=None):
+    """Replay dispatch of cost-sorted jobs over `workers` slots
+
+    Returns the projected wall time and how many jobs a runtime `budget` would defer.
+    """
+    free = [0.0] * workers  # when each worker slot is next available
+    end = 0.0
+    for position, job in enumerate(jobs):
+        start = heapq.heappop(free)
+        if budget is not None and start + job.cost > budget:
+            return end, len(jobs) - position
+        heapq.heappush(free, start + job.cost)
+        end = max(end, start + job.cost)
+    return end, 0
+
+def write_plan(args):
+    """Write the work list of a full pass as JSON or CSV without converting anything"""
+    started = time.monotonic()
+    state = StateStore.open(args.state_dir)
+    try:
+        books = get_all_books(args.library, server=args.server)
+        work = select_jobs(books, state, args.targets, stat_sources=False)
+        rates = state.cost_rates()
+    finally:
+        state.close()
+
+    jobs = work.jobs
+    projected, deferred = project_runtime(jobs, args.jobs, args.max_runtime)
+    formats = {}
+    for job in jobs:
+        totals = formats.setdefault(job.source_format, {"books": 0, "bytes": 0, "estimated_seconds": 0.0})
+        totals["books"] += 1
+        totals["bytes"] += job.signature[0] or 0
+        totals["estimated_seconds"] += job.cost
+    for fmt, totals in formats.items():
+        totals["estimated_seconds"] = round(totals["estimated_seconds"], 1)
+        # Measured rates come from past runs, the rest from FORMAT_COST
+        totals["rate_source"] = "measured" if fmt in rates else "default"
+
+    summary = {
+        "library": args.library,
+        "generated": utc_timestamp(),
+        "workers": args.jobs,
+        "targets": args.targets,
+        "books": len(books),
+        "to_convert": len(jobs),
+        "already_converted": work.skipped,
+        "unconvertible": len(work.unconvertible),
+        "waiting_for_retry": work.waiting,
+        "quarantined": work.quarantined,
+        "bytes": sum(job.signature[0] or 0 for job in jobs),
+        "estimated_seconds": round(sum(job.cost for job in jobs), 1),
+        "projected_runtime_seconds": round(projected, 1),
+        "max_runtime_seconds": args.max_runtime,
+        "deferred": deferred,
+        "formats": formats,
+    }
+    last = len(jobs) - deferred  # jobs run in this order, so the tail is what a budget defers
+    rows = [
+        {"book_id": job.book.id, "source_format": job.source_format, "targets": "+".join(job.targets),
+         "size": job.signature[0] or 0, "estimated_seconds": round(job.cost, 2), "deferred": position >= last}
+        for position, job in enumerate(jobs)
+    ]
+
+    temp = f"{args.plan}.{os.getpid()}.tmp"
+    try:
+        f = open(temp, "w", newline="")
+    except OSError as e:
+        print(f"❌ Cannot write plan to {args.plan}: {e}")
+        return 1
+    with f:
+        if args.plan.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else
+                                    ["book_id", "source_format", "targets", "size", "estimated_seconds", "deferred"])
+            writer.writeheader()
+            writer.writerows(rows)  # books only: the totals are printed below
+        else:
+            json.dump({**summary, "jobs": rows}, f, indent=1)
+    os.replace(temp, args.plan)
+
+    print(f"📋 Plan for {len(books)} books written to {args.plan} ({format_duration(time.monotonic() - started)})")
+    print(f"   To convert: {len(jobs)} ({summary['bytes'] / 1048576:.0f} MB, "
+          f"~{format_duration(summary['estimated_seconds'])} of conversion)")
+    for fmt, totals in sorted(formats.items(), key=lambda item: -item[1]["estimated_seconds"]):
+        print(f"     {fmt:<5} {totals['books']:>7} books  ~{format_duration(totals['estimated_seconds'])} "
+              f"({totals['rate_source']} rate)")
+    print(f"   Already have {', '.join(args.targets)}: {work.skipped}")
+    print(f"   No convertible format: {len(work.unconvertible)}")
+    if work.waiting:
+        print(f"   Waiting for retry: {work.waiting}")
+    if work.quarantined:
+        print(f"   Quarantined: {work.quarantined}")
+    print(f"   Projected runtime: {format_duration(projected)} with {args.jobs} workers")
+    if deferred:
+        print(f"   Deferred by --max-runtime: {deferred}")
+    return 0
+
+def run_pass(args, pressure=None):
+    """Convert every book that needs it, as one batch
+
+    `pressure` carries the host pressure limit over from earlier passes in watch mode.
+    """
+    state = StateStore.open(args.state_dir)
+    since = None if args.full else state.get_meta("last_modified")
+    markers_dir = os.path.join(args.state_dir, PUBLISHING_DIR_NAME)
+
+    # Pick up where a killed run stopped: its outcomes, and the files it published but never registered
+    journal = Journal.open(args.state_dir) if os.path.isdir(args.state_dir) else None
+    resumed, again = journal.resume(state, markers_dir) if journal is not None else ([], [])
+    if resumed:
+        print(f"♻️  Registering {len(resumed)} books converted by an interrupted run")
+
+    if since:
+        print(f"📚 Looking for books changed since {since}")
+    else:
+        print(f"📚 Looking for books in library")
+    probe_targets(args.targets, args.scratch_dir)
+    index = LibraryIndex(args.library)
+    # Books are found and checked while the first ones already convert (see Discovery)
+    discovery = Discovery(args.library, state.path, since, state.pending() + again, args.targets, index,
+                          journal, exclude=[job.book.id for job in resumed], server=args.server)
+
+    converted = 0
+    errors = 0
+    deferred = 0
+    quarantined = 0
+
+    started = time.monotonic()
+    deadline = started + args.max_runtime if args.max_runtime else None
+
+    warm = None
+    if args.redis:
+        try:
+            warm = RemoteQueue(args.redis, read_password_file(args.redis_password_file))
+            print(f"🌐 Distributing conversions through Redis at {redis_address(args.redis)}")
+        except (OSError, RedisError) as e:
+            print(f"⚠️  Cannot use Redis at {redis_address(args.redis)} ({e}); converting locally")
+    if warm is None and args.warm_workers:
+        warm = WarmWorkerPool()
+    governor = MemoryGovernor.open(warm if isinstance(warm, RemoteQueue) else None)
+    if isinstance(warm, RemoteQueue):
+        pressure = None  # workers watch the pressure on their own nodes
+    elif pressure is None:
+        pressure = HostPressure.from_args(args)
+    paused, throttled = (pressure.paused, pressure.throttled) if pressure else (0, 0)
+    if governor.limit and governor.remote is None:
+        print(f"🧠 {governor.budget(args.jobs) / 1048576:.0f} MB of memory per conversion "
+              f"({governor.limit / 1048576:.0f} MB limit, new conversions wait above {MEMORY_HEADROOM:.0%})")
+    registrar = Registrar(args.library, args.register_batch, server=args.server)
+    scratch = ScratchDir(args.scratch_dir)
+    try:
+        os.makedirs(markers_dir, exist_ok=True)
+        recover_published(args.library, markers_dir, {marker for job in resumed for marker in job.markers}, args.server)
+        # Older versions staged conversions, and kept the cache, inside the state directory
+        remove_stale_dirs(args.state_dir, "staging-")
+        legacy_cache = os.path.join(args.state_dir, "cache")
+        if os.path.isdir(legacy_cache) and os.path.realpath(legacy_cache) != os.path.realpath(args.cache_dir):
+            print(f"🧹 Removing the conversion cache from {legacy_cache}; it now lives in {args.cache_dir}")
+            shutil.rmtree(legacy_cache, ignore_errors=True)
+    except OSError:
+        markers_dir = scratch.path  # no state directory: nothing survives a crash to clean up after
+    cache = ConversionCache.open(args.cache_dir, args.cache_size)
+    profiler = Profiler.open(args.profile_dir, args.conversion_profile)
+    PROGRESS.begin(args.jobs, "incremental" if since else "full")
+
+    def report(job, success, message):
+        nonlocal converted, errors, quarantined
+        print(f"\n📖 Book #{job.book.id} ({job.source_format} → {', '.join(job.targets)})")
+        book_completed()
         if success:
             print(f"   ✅ {message}")
             converted += 1
+            BOOKS_TOTAL.inc(result="reused" if job.reused else "converted")
+            PROGRESS.done(job.book.id, "reused" if job.reused else "converted")
+            state.record(job.book.id, "converted", job.source_format, job.signature, message, job.duration)
+            if journal is not None:
+                journal.outcome(job, "converted", message=message, duration=job.duration)
+            return
+
+        print(f"   ❌ {message}")
+        errors += 1
+        attempts = job.attempts + 1
+        timeouts = job.timeouts + job.timed_out
+        if attempts >= MAX_ATTEMPTS:
+            print(f"   🚫 Quarantined after {attempts} failed attempts")
+            quarantined += 1
+            BOOKS_TOTAL.inc(result="quarantined")
+            PROGRESS.done(job.book.id, "quarantined")
+            state.record(job.book.id, "quarantined", job.source_format, job.signature, message,
+                         attempts=attempts, timeouts=timeouts)
+            if journal is not None:
+                journal.outcome(job, "quarantined", message=message, attempts=attempts, timeouts=timeouts)
         else:
-            print(f"   ❌ {message}")
-            errors += 1
+            retry_in = RETRY_BACKOFF * 2 ** (attempts - 1)
+            print(f"   🔁 Will retry in {format_duration(retry_in)} (attempt {attempts}/{MAX_ATTEMPTS})")
+            BOOKS_TOTAL.inc(result="failed")
+            PROGRESS.done(job.book.id, "failed")
+            state.record(job.book.id, "failed", job.source_format, job.signature, message,
+                         attempts=attempts, timeouts=timeouts, next_attempt=time.time() + retry_in)
+            if journal is not None:
+                journal.outcome(job, "failed", message=message, attempts=attempts, timeouts=timeouts,
+                                next_attempt=time.time() + retry_in)
+
+    def carry_over(job):
+        nonlocal deferred
+        if not deferred:
+            print(f"\n⏰ Runtime budget reached, carrying books that no longer fit over to the next run")
+        state.record(job.book.id, "pending", job.source_format, job.signature,
+                     attempts=job.attempts, timeouts=job.timeouts, deferrals=job.deferrals + 1)
+        deferred += 1
+        BOOKS_TOTAL.inc(result="deferred")
+        PROGRESS.done(job.book.id, "deferred", counted=False)
+
+    for job in resumed:
+        PROGRESS.converted(job.book.id)
+        registrar.add(job)
+
+    # Workers only convert, the registrar thread is the only library writer, and this thread reports
+    finished = False
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            running = {}
+            metrics_written = status_written = 0
+            while True:
+                # Keep the pool full without queueing the whole library at once, nor more than fits in memory,
+                # and fewer while the host is busy
+                if running:
+                    governor.sample()
+                limit = args.jobs if pressure is None else min(args.jobs, pressure.update(not discovery.done))
+                while len(running) < limit and governor.can_start(len(running)):
+                    job = discovery.next()
+                    if job is None:
+                        break
+                    if deadline is not None and time.monotonic() + job.cost > deadline:
+                        # Windows are sorted separately, so a cheaper job may still come
+                        carry_over(job)
+                        continue
+                    if journal is not None:
+                        journal.append("converting", book=job.book.id)
+                    PROGRESS.converting(job.book.id, book_id=job.book.id, path=job.book.path,
+                                        source_format=job.source_format, targets=job.targets)
+                    running[pool.submit(convert_and_publish, job, scratch.path, markers_dir,
+                                        index, warm, cache, profiler, args.conversion_profile)] = job
+                if deadline is not None and time.monotonic() >= deadline:
+                    # Out of time, possibly while paused for host pressure: nothing else can start,
+                    # and the books not found yet are found again by the next run
+                    discovery.stop()
+                    for job in iter(discovery.next, None):
+                        carry_over(job)
+                QUEUE_DEPTH.set(discovery.queued())
+                RUNNING_JOBS.set(len(running))
+                PROGRESS.waiting(discovery.queued(), discovery.searching)
+                if args.metrics_textfile and time.monotonic() - metrics_written >= METRICS_TEXTFILE_INTERVAL:
+                    write_metrics_textfile(args.metrics_textfile)
+                    metrics_written = time.monotonic()
+                if args.status_file and time.monotonic() - status_written >= STATUS_FILE_INTERVAL:
+                    write_status_file(args.status_file)
+                    status_written = time.monotonic()
+                if not running and discovery.done:
+                    break
+
+                if running:
+                    done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    discovery.wait(1)  # for the next jobs, or while paused for host pressure
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        success, message = future.result()
+                    except Exception as e:
+                        success, message = False, f"Unexpected error: {e}"
+                    if success:
+                        if journal is not None:
+                            journal.converted(job)
+                        PROGRESS.converted(job.book.id)
+                        registrar.add(job)
+                    else:
+                        report(job, False, message)
+
+                for outcome in registrar.results():
+                    report(*outcome)
+                state.commit()
+
+        for outcome in registrar.close():
+            report(*outcome)
+        finished = discovery.error is None
+    finally:
+        if warm is not None:
+            warm.close()
+        scratch.close()
+        if cache is not None:
+            cache.evict()
+        state.commit()
+        if journal is not None:
+            journal.close(finished)
+
+    work = discovery.work
+    for book_id in work.unconvertible:
+        state.record(book_id, "skipped", message="no convertible format")
+    skipped = work.skipped
+    waiting = work.waiting
+    quarantined += work.quarantined
+    if discovery.error is not None:
+        print(f"⚠️  Finding books failed ({discovery.error}); the rest are converted next run")
+    elif discovery.newest is None and discovery.stopped.is_set():
+        print(f"⏰ Stopped looking for books at the runtime budget; the rest are found next run")
+    # Next run only needs books Calibre touched after this scan (including our own add_format)
+    newest = discovery.newest
+    if newest and (since is None or newest > since):
+        state.set_meta("last_modified", newest)
+    state.close()
+
+    QUEUE_DEPTH.set(0)
+    RUNNING_JOBS.set(0)
+    LAST_RUN_TIMESTAMP.set(time.time())
+    LAST_RUN_DURATION.set(time.monotonic() - started)
+    if args.metrics_textfile:
+        write_metrics_textfile(args.metrics_textfile)
+    PROGRESS.end(books_checked=discovery.books, skipped=skipped, waiting_for_retry=waiting)
+    if args.status_file:
+        write_status_file(args.status_file)
 
     print("-" * 50)
     print(f"✨ Conversion complete!")
+    print(f"   Books checked: {discovery.books}")
     print(f"   Converted: {converted}")
-    print(f"   Skipped: {skipped} (already have EPUB)")
+    available = [fmt for fmt in args.targets if fmt not in UNAVAILABLE_TARGETS]
+    print(f"   Skipped: {skipped} (already have {', '.join(available)})")
     print(f"   Errors: {errors}")
+    if waiting:
+        print(f"   Waiting for retry: {waiting}")
+    if quarantined:
+        print(f"   Quarantined: {quarantined} (see --list-quarantine)")
+    if deferred:
+        print(f"   Deferred: {deferred} (carried over to the next run)")
+    if governor.held_seconds() >= 1:
+        print(f"   Held back for memory: {format_duration(governor.held_seconds())}")
+    if pressure is not None and pressure.paused - paused >= 1:
+        print(f"   Paused for host load: {format_duration(pressure.paused - paused)}")
+    if pressure is not None and pressure.throttled - throttled >= 1:
+        print(f"   Slowed for host load: {format_duration(pressure.throttled - throttled)}")
+    print(f"   Elapsed: {format_duration(time.monotonic() - started)}")
+    if profiler is not None:
+        try:
+            path = profiler.report()
+            if path:
+                print(f"📊 Profile written to {path}")
+        except OSError as e:
+            print(f"⚠️  Cannot write profile report ({e})")
+
+    return converted, skipped, errors
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.list_quarantine:
+        return show_quarantine(args)
+    if args.clear_quarantine is not None:
+        return clear_quarantine(args)
+    if args.plan:
+        return write_plan(args)
+
+    print("🔄 Calibre Library Converter - Starting...")
+    if args.worker:
+        print(f"Redis: {redis_address(args.redis)}")
+    else:
+        print(f"Library: {args.library}")
+    if args.server is not None:
+        print(f"Calibre server: {args.server.url}")
+    print(f"Target formats: {', '.join(args.targets)}")
+    if not args.worker:
+        print(f"Conversion profile: {args.conversion_profile}")
+    print(f"Workers: {args.jobs}" + (f" (from {args.jobs_source})" if args.jobs_source else ""))
+    print("-" * 50)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.watch or args.worker:
+        # Swarm stops services with SIGTERM; leave the same way as Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            if args.worker:
+                warm = WarmWorkerPool() if args.warm_workers else None
+                password = read_password_file(args.redis_password_file)
+                RemoteWorker(
+                    args.redis, password, args.jobs, warm, args.scratch_dir, HostPressure.from_args(args),
+                    args.status_file
+                ).run()
+            else:
+                watch(args)
+        except KeyboardInterrupt:
+            pass
+        print("👋 Converter stopped")
+        return 0
 
+    run_pass(args)
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+Shared fixtures for the converter tests
+Calibre is replaced by the benchmark's stub tools and libraries come from its generator
+"""
+
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+STACK_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(STACK_DIR))
+sys.path.insert(0, str(STACK_DIR / "bench"))
+
+import converter  # noqa: E402
+from synthetic_library import generate  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def calibre(monkeypatch, tmp_path):
+    """Stub Calibre tools on PATH, without delays; returns the file counting their calls"""
+    calls = tmp_path / "calls"
+    monkeypatch.setenv("PATH", f"{STACK_DIR / 'bench' / 'stubs'}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setenv("BENCH_CALL_LOG", str(calls))
+    for variable in ("BENCH_STARTUP_LATENCY", "BENCH_CONVERT_LATENCY", "BENCH_CALIBREDB_LATENCY"):
+        monkeypatch.setenv(variable, "0")
+    monkeypatch.setattr(converter, "UNAVAILABLE_TARGETS", set())
+    return calls
+
+@pytest.fixture
+def library(tmp_path):
+    """A 30-book synthetic library"""
+    root = tmp_path / "library"
+    generate(str(root), 30)
+    return root
+
+@pytest.fixture
+def convert(library, tmp_path):
+    """Run one converter pass over the library; returns (converted, skipped, errors)"""
+    def convert(*options):
+        args = converter.parse_args([
+            "--library", str(library), "--jobs", "2", "--scratch-dir", str(tmp_path / "scratch"),
+            "--max-cpu-pressure", "0", "--max-io-pressure", "0", "--max-load", "0", *options,
+        ])
+        return converter.run_pass(args)
+    return convert
+
+@pytest.fixture
+def state(library):
+    """Open the library's state store; closed after the test"""
+    stores = []
+
+    def state():
+        store = converter.StateStore.open(str(library / converter.STATE_DIR_NAME))
+        stores.append(store)
+        return store
+    yield state
+    for store in stores:
+        store.close()
+
+def formats(library):
+    """{book_id: {format, ...}} as metadata.db has them"""
+    conn = sqlite3.connect(library / "metadata.db")
+    try:
+        books = {}
+        for book_id, fmt in conn.execute("SELECT book, format FROM data"):
+            books.setdefault(book_id, set()).add(fmt.lower())
+        return books
+    finally:
+        conn.close()
+
+def ebook_converts(calls):
+    """How many times ebook-convert ran, from the `calibre` fixture's call log"""
+    return calls.read_text().split().count("ebook-convert") if calls.exists() else 0
+
+def needing(library, fmt="epub"):
+    """IDs of books that can be converted and lack `fmt`, lowest first"""
+    return sorted(book_id for book_id, have in formats(library).items()
+                  if fmt not in have and have & set(converter.CONVERT_FROM))
+
+@pytest.fixture
+def redis(monkeypatch):
+    """An in-process Redis (see fake_redis), with distributed mode's timings cut to fractions of a second"""
+    from fake_redis import FakeRedis
+
+    monkeypatch.setattr(converter, "HEARTBEAT_INTERVAL", 0.1)
+    monkeypatch.setattr(converter, "LEASE_SECONDS", 0.5)
+    server = FakeRedis()
+    yield server
+    server.close()
+
+def mobi_books(library, count):
+    """Books converted from MOBI by ebook-convert, with their MOBI path"""
+    books = converter.read_books_from_db(str(library), ids=needing(library))
+    return [book for book in books if "mobi" in book.formats][:count]
@@ -0,0 +1,189 @@
+"""
+In-process Redis speaking RESP over TCP, with just the commands distributed mode uses
+Lets the tests drive the real RedisClient, RemoteQueue and RemoteWorker without a Redis server
+"""
+
+import socketserver
+import threading
+import time
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), Connection)
+        self.password = password
+        self.data = {}  # key -> bytes, list, dict (hash) or {member: score} (sorted set, see `zsets`)
+        self.zsets = set()
+        self.commands = []  # names of the commands received, in order
+        self.changed = threading.Condition()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"redis://{self.server_address[0]}:{self.server_address[1]}/0"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def execute(self, name, args):
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            return RuntimeError(f"ERR unknown command '{name}'")
+        with self.changed:
+            self.commands.append(name.upper())
+            return handler(*args)
+
+    def blocking(self, timeout, attempt):
+        """Retry `attempt` until it returns something other than None or `timeout` seconds pass"""
+        deadline = time.monotonic() + float(timeout)
+        with self.changed:
+            while True:
+                result = attempt()
+                if result is not None or time.monotonic() >= deadline:
+                    return result
+                self.changed.wait(min(0.05, max(0.0, deadline - time.monotonic())))
+
+    def list(self, key):
+        return self.data.setdefault(key, [])
+
+    def zset(self, key):
+        self.zsets.add(key)
+        return self.data.setdefault(key, {})
+
+    def notify(self, result):
+        self.changed.notify_all()
+        return result
+
+    def cmd_auth(self, password):
+        return "OK" if password.decode() == self.password else RuntimeError("WRONGPASS invalid password")
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_del(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def cmd_expire(self, key, seconds):
+        return int(key in self.data)
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = value
+        return self.notify("OK")
+
+    def cmd_get(self, key):
+        return self.data.get(key)
+
+    def cmd_hset(self, key, *pairs):
+        fields = self.data.setdefault(key, {})
+        added = sum(name not in fields for name in pairs[::2])
+        fields.update(zip(pairs[::2], pairs[1::2]))
+        return added
+
+    def cmd_hgetall(self, key):
+        return [part for pair in self.data.get(key, {}).items() for part in pair]
+
+    def cmd_hincrby(self, key, name, amount):
+        fields = self.data.setdefault(key, {})
+        fields[name] = str(int(fields.get(name, b"0")) + int(amount)).encode()
+        return int(fields[name])
+
+    def cmd_rpush(self, key, *values):
+        self.list(key).extend(values)
+        return self.notify(len(self.data[key]))
+
+    def cmd_lpush(self, key, *values):
+        for value in values:
+            self.list(key).insert(0, value)
+        return self.notify(len(self.data[key]))
+
+    def cmd_lrem(self, key, count, value):
+        items = self.data.get(key, [])
+        removed = items.count(value)
+        items[:] = [item for item in items if item != value]
+        return removed
+
+    def cmd_lrange(self, key, start, stop):
+        items = self.data.get(key, [])
+        stop = int(stop)
+        return items[int(start):None if stop == -1 else stop + 1]
+
+    def cmd_blpop(self, key, timeout):
+        def pop():
+            items = self.data.get(key)
+            return [key, items.pop(0)] if items else None
+        return self.blocking(timeout, pop)
+
+    def cmd_blmove(self, source, destination, where_from, where_to, timeout):
+        def move():
+            items = self.data.get(source)
+            if not items:
+                return None
+            value = items.pop(0 if where_from.upper() == b"LEFT" else -1)
+            target = self.list(destination)
+            target.insert(0, value) if where_to.upper() == b"LEFT" else target.append(value)
+            return value
+        return self.blocking(timeout, move)
+
+    def cmd_zadd(self, key, *args):
+        xx = args[0].upper() == b"XX"
+        args = args[1:] if xx else args
+        members = self.zset(key)
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            if xx and member not in members:
+                continue
+            added += member not in members
+            members[member] = float(score)
+        return added
+
+    def cmd_zrem(self, key, *members):
+        scores = self.zset(key)
+        return sum(scores.pop(member, None) is not None for member in members)
+
+    def cmd_zscore(self, key, member):
+        score = self.zset(key).get(member)
+        return None if score is None else repr(score).encode()
+
+    def cmd_zcount(self, key, low, high):
+        low, high = (float(value.replace(b"inf", b"Infinity")) for value in (low, high))
+        return sum(low <= score <= high for score in self.zset(key).values())
+
+    def cmd_zrangebyscore(self, key, low, high):
+        low, high = (float(value.replace(b"inf", b"Infinity")) for value in (low, high))
+        scores = self.zset(key)
+        return [member for member, score in sorted(scores.items(), key=lambda item: item[1]) if low <= score <= high]
+
+class Connection(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.wfile.write(encode(self.server.execute(args[0].decode(), args[1:])))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+def encode(value):
+    if isinstance(value, Exception):
+        return b"-%s\r\n" % str(value).encode()
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
@@ -0,0 +1,52 @@
+"""Conversion cache: content hashes, and which books may share a cached conversion"""
+
+import hashlib
+import zipfile
+
+import converter
+
+def test_chunked_hash_covers_the_whole_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(converter, "HASH_CHUNK_SIZE", 1024)
+    path = tmp_path / "book.mobi"
+    path.write_bytes(bytes(range(256)) * 20)
+    data = path.read_bytes()
+
+    tree = hashlib.blake2b(len(data).to_bytes(8, "little"), digest_size=32)
+    for start in range(0, len(data), 1024):
+        tree.update(hashlib.blake2b(data[start:start + 1024], digest_size=32).digest())
+    assert converter.hash_file(path) == tree.hexdigest()
+
+    path.write_bytes(data[:-1] + b"\0")
+    assert converter.hash_file(path) != tree.hexdigest()
+
+def book(library, book_id, title, author, text):
+    folder = library / author / f"{title} ({book_id})"
+    folder.mkdir(parents=True)
+    source = folder / f"{title} - {author}.txt"
+    source.write_text(text)
+    return converter.Job(converter.Book(book_id, str(folder.relative_to(library)), {"txt": str(source)}),
+                         "txt", converter.source_signature(source))
+
+def title(job):
+    with zipfile.ZipFile(job.outputs["epub"]) as epub:
+        return epub.read("OEBPS/content.opf").decode().split("<dc:title>")[1].split("<")[0]
+
+def convert(job, tmp_path, cache):
+    scratch = tmp_path / "scratch" / str(job.book.id)
+    scratch.mkdir(parents=True)
+    assert converter.convert_book(job, str(scratch), cache=cache)[0]
+
+def test_native_epubs_are_not_shared_between_books(tmp_path):
+    cache = converter.ConversionCache(str(tmp_path / "cache"), 1024 ** 3)
+    library = tmp_path / "library"
+    text = "Chapter 1\n\nThe same file, imported twice.\n"
+    first = book(library, 1, "First", "Author A", text)
+    second = book(library, 2, "Second", "Author B", text)
+    again = book(library, 3, "First", "Author A", text)
+
+    for job in (first, second, again):
+        convert(job, tmp_path, cache)
+
+    assert (title(first), title(second), title(again)) == ("First", "Second", "First")
+    assert not first.reused and not second.reused
+    assert again.reused
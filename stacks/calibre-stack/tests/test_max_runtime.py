@@ -0,0 +1,62 @@
+"""Books carried over by --max-runtime are counted, found first and dispatched ahead of cheaper ones"""
+
+import time
+
+import converter
+from conftest import formats, generate, needing
+
+def pending(store):
+    return dict(store.conn.execute("SELECT book_id, deferrals FROM conversions WHERE status = 'pending'"))
+
+def test_deferrals_are_counted_across_runs(convert, state):
+    # MOBI and DJVU sources are estimated at several seconds each, TXT at a fraction of one
+    convert("--max-runtime", "2")
+    first = pending(state())
+    assert first and set(first.values()) == {1}
+
+    convert("--max-runtime", "2")
+    assert pending(state()) == {book_id: 2 for book_id in first}
+
+def test_carried_over_book_is_dispatched_first(library, state):
+    store = state()
+    book_id = max(book_id for book_id in needing(library) if "mobi" in formats(library)[book_id])
+    book = converter.read_books_from_db(str(library), ids=[book_id])[0]
+    store.record(book_id, "pending", "mobi", converter.source_signature(book.formats["mobi"]), deferrals=1)
+
+    books = list(converter.iter_books(str(library), also=[book_id]))
+    assert books[0].id == book_id
+    assert sorted(book.id for book in books) == sorted(formats(library))
+
+    jobs = converter.select_jobs(books, store).jobs
+    assert jobs[0].book.id == book_id and jobs[0].deferrals == 1
+    assert jobs[1].cost < jobs[0].cost
+
+def test_incremental_run_finds_carried_over_books_first(library, state):
+    books = list(converter.iter_books(str(library), since="2999-01-01 00:00:00+00:00", also=[3, 1]))
+    assert [book.id for book in books] == [1, 3]
+
+def discover(library, stop_after=None):
+    """Run a Discovery over the library, stopping it once it found `stop_after` jobs; returns it when done"""
+    discovery = converter.Discovery(str(library), str(library / "state.db"))
+    while stop_after is not None and discovery.found < stop_after and discovery.searching:
+        time.sleep(0.01)
+    if stop_after is not None:
+        discovery.stop()
+    while not discovery.done:
+        if discovery.next() is None:
+            discovery.wait(0.01)
+    discovery.thread.join()
+    return discovery
+
+def test_stopped_discovery_keeps_the_watermark(tmp_path, monkeypatch):
+    # Windows of a page each, so discovery waits for the dispatcher after a few pages
+    monkeypatch.setattr(converter, "BOOK_PAGE", 5)
+    monkeypatch.setattr(converter, "DISCOVERY_WINDOW", 5)
+    library = tmp_path / "library"
+    generate(str(library), 200)
+
+    stopped = discover(library, stop_after=5)
+    assert stopped.newest is None
+    assert stopped.books < 200
+
+    assert discover(library).newest
@@ -0,0 +1,25 @@
+"""Conversions that run on the coordinator count against its memory limit, also in distributed mode"""
+
+from types import SimpleNamespace
+
+import converter
+
+LIMIT = 2 * 1024 ** 3  # the service's 2G; room for 4 conversions at JOB_MEMORY, not 5
+
+def governor(remote=None):
+    governor = converter.MemoryGovernor(limit=LIMIT, remote=remote)
+    governor.base = governor.current = 0
+    return governor
+
+def test_local_conversions_fill_the_limit():
+    assert governor().can_start(3)
+    assert not governor().can_start(4)
+
+def test_conversions_on_workers_do_not_count():
+    assert governor(SimpleNamespace(in_flight=8)).can_start(8)
+    assert governor(SimpleNamespace(in_flight=5)).can_start(8)
+
+def test_local_fallbacks_count_in_distributed_mode():
+    # No worker checked in, or sources too big for Redis: everything runs on the coordinator
+    assert not governor(SimpleNamespace(in_flight=0)).can_start(4)
+    assert not governor(SimpleNamespace(in_flight=2)).can_start(6)
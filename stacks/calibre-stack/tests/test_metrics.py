@@ -0,0 +1,29 @@
+"""Prometheus metrics computed at scrape time"""
+
+import collections
+import threading
+import time
+
+import converter
+
+def test_concurrent_scrapes_trim_completions_safely(monkeypatch):
+    old = time.monotonic() - converter.THROUGHPUT_WINDOW - 1
+    monkeypatch.setattr(converter, "COMPLETIONS", collections.deque([old] * 200_000))
+    for _ in range(30):
+        converter.book_completed()
+    rates, errors = [], []
+
+    def scrape():
+        try:
+            rates.append(converter.books_per_minute())
+        except Exception as e:
+            errors.append(e)
+
+    scrapes = [threading.Thread(target=scrape) for _ in range(8)]
+    for thread in scrapes:
+        thread.start()
+    for thread in scrapes:
+        thread.join()
+
+    assert errors == []
+    assert rates == [30 * 60 / converter.THROUGHPUT_WINDOW] * 8
@@ -0,0 +1,32 @@
+"""--plan writes the work list without converting anything"""
+
+import csv
+import json
+
+import pytest
+
+import converter
+from conftest import needing
+
+def plan(library, path, *options):
+    args = converter.parse_args(["--library", str(library), "--plan", str(path), "--jobs", "2", *options])
+    assert converter.write_plan(args) == 0
+
+def test_csv_plan_has_one_row_per_book(library, tmp_path, capsys):
+    path = tmp_path / "plan.csv"
+    plan(library, path, "--max-runtime", "10")
+
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(int(row["book_id"]) for row in rows) == needing(library)
+    assert {row["deferred"] for row in rows} == {"True", "False"}
+    assert "To convert: " in capsys.readouterr().out
+
+def test_json_plan_totals(library, tmp_path):
+    path = tmp_path / "plan.json"
+    plan(library, path)
+
+    with open(path) as f:
+        result = json.load(f)
+    assert result["to_convert"] == len(result["jobs"]) == len(needing(library))
+    assert result["estimated_seconds"] == pytest.approx(sum(job["estimated_seconds"] for job in result["jobs"]), abs=0.1)
@@ -0,0 +1,28 @@
+"""Files a killed run published into book folders but never registered are removed by the next one"""
+
+import json
+import os
+import shutil
+
+import converter
+from conftest import mobi_books
+
+def test_unregistered_outputs_of_a_killed_run_are_removed(library, tmp_path):
+    orphan, registered = mobi_books(library, 2)
+    markers = tmp_path / "publishing"
+    markers.mkdir()
+    epub = orphan.formats["mobi"][:-len("mobi")] + "epub"
+    temp = epub + ".tmp"
+    for path in (epub, temp):
+        shutil.copyfile(orphan.formats["mobi"], path)
+    # Calibre has this one on record, so it stays whatever the marker says
+    kept = registered.formats["mobi"]
+    for book_id, fmt, path, leftover in ((orphan.id, "epub", epub, temp), (registered.id, "mobi", kept, kept + ".tmp")):
+        (markers / f"{book_id}.{fmt}.json").write_text(
+            json.dumps({"book": book_id, "format": fmt, "temp": leftover, "path": path}))
+
+    converter.recover_published(str(library), str(markers))
+
+    assert not any(os.path.exists(path) for path in (epub, temp))
+    assert os.path.exists(kept)
+    assert list(markers.iterdir()) == []
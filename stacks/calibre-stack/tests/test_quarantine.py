@@ -0,0 +1,43 @@
+"""Quarantined books are left alone until released, then converted by the next incremental run"""
+
+from conftest import formats, needing
+
+def quarantine(store, book_id):
+    store.record(book_id, "quarantined", "mobi", attempts=5, message="boom")
+    store.commit()
+
+def test_quarantined_book_is_skipped(library, convert, state):
+    book_id = needing(library)[0]
+    quarantine(state(), book_id)
+
+    convert()
+
+    assert "epub" not in formats(library)[book_id]
+    assert [row[0] for row in state().quarantined()] == [book_id]
+
+def test_released_book_is_converted_incrementally(library, convert, state):
+    book_id = needing(library)[0]
+    quarantine(state(), book_id)
+    convert()
+    store = state()
+    assert store.get_meta("last_modified")
+
+    assert store.clear_quarantine([book_id]) == 1
+    store.commit()
+    assert store.get(book_id)[0] == "pending"
+    assert store.pending() == [book_id]
+
+    convert()
+
+    assert "epub" in formats(library)[book_id]
+    assert state().get(book_id)[0] == "converted"
+
+def test_clear_quarantine_only_releases_the_given_books(library, state):
+    store = state()
+    quarantine(store, 1)
+    quarantine(store, 2)
+
+    assert store.clear_quarantine([2]) == 1
+    assert [row[0] for row in store.quarantined()] == [1]
+    assert store.clear_quarantine() == 1
+    assert store.quarantined() == []
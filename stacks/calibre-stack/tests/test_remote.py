@@ -0,0 +1,83 @@
+"""Distributed mode over the Redis protocol: coordinator, workers and lost jobs"""
+
+import threading
+import time
+
+import pytest
+
+import converter
+from converter import redis_key
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def submit(queue, tmp_path, name="1"):
+    """Start a conversion through `queue` on a thread; returns the list its result is appended to"""
+    source = tmp_path / f"{name}.mobi"
+    source.write_bytes(b"MOBI " * 100)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(queue.convert(str(source), str(tmp_path / f"{name}.epub"),
+                                                                         60)), daemon=True)
+    thread.start()
+    return result
+
+def test_job_lost_by_every_worker_fails(redis, tmp_path):
+    client = converter.RedisClient(redis.url)
+    client.execute("ZADD", redis_key("workers"), time.time() + 3600, "ghost")
+    queue = converter.RemoteQueue(redis.url)
+    try:
+        result = submit(queue, tmp_path)
+        for lost in range(converter.MAX_REQUEUES + 1):
+            # A worker claims the job and dies: its lease runs out without a heartbeat
+            wait_for(lambda: client.execute("LRANGE", redis_key("queue"), 0, -1))
+            job_id = client.execute("BLMOVE", redis_key("queue"), redis_key("processing"), "LEFT", "RIGHT", 1, block=1)
+            client.execute("ZADD", redis_key("leases"), time.time() - 1, job_id)
+            if lost < converter.MAX_REQUEUES:
+                wait_for(lambda: client.execute("LRANGE", redis_key("queue"), 0, -1) == [job_id])
+        wait_for(lambda: result)
+    finally:
+        queue.close()
+
+    assert result == [(False, f"Lost by {converter.MAX_REQUEUES + 1} workers (worker stopped sending heartbeats)")]
+
+def test_worker_converts_for_the_coordinator(redis, tmp_path):
+    redis.password = "s3cret"
+    worker = converter.RemoteWorker(redis.url, "s3cret", scratch_dir=str(tmp_path),
+                                    pressure=converter.HostPressure(1, 0, 0, 0))
+    converter.RedisClient(redis.url, "s3cret").execute("ZADD", redis_key("workers"), time.time(), worker.name)
+    slot = threading.Thread(target=worker.work, args=(0,), daemon=True)
+    slot.start()
+    queue = converter.RemoteQueue(redis.url, "s3cret")
+    try:
+        source = tmp_path / "book.mobi"
+        source.write_bytes(b"MOBI " * 100_000)
+        output = tmp_path / "book.epub"
+        assert queue.convert(str(source), str(output), 60) == (True, "")
+    finally:
+        worker.stop.set()
+        slot.join()
+        queue.close()
+        worker.scratch.close()
+
+    assert output.read_bytes() == source.read_bytes()  # the stub ebook-convert copies its input
+    assert queue.timings[str(output)] is not None
+    # The job, its source and the EPUB are deleted from Redis once delivered
+    assert not [key for key in redis.data if key.split(b":")[1] in (b"job", b"source", b"output")]
+
+def test_book_is_converted_locally_without_workers(redis, tmp_path):
+    queue = converter.RemoteQueue(redis.url)
+    try:
+        source = tmp_path / "book.mobi"
+        source.write_bytes(b"MOBI")
+        assert queue.convert(str(source), str(tmp_path / "book.epub"), 60) is None
+    finally:
+        queue.close()
+    assert redis.data.get(redis_key("queue").encode()) == []
+
+def test_wrong_password_is_refused(redis):
+    redis.password = "s3cret"
+    with pytest.raises(converter.RedisError):
+        converter.RemoteQueue(redis.url, "guess")
@@ -0,0 +1,37 @@
+"""A killed run is resumed from its journal"""
+
+import json
+import shutil
+
+import converter
+from conftest import ebook_converts, formats, mobi_books
+
+def test_killed_run_is_resumed(library, convert, state, calibre):
+    published, converting = mobi_books(library, 2)
+    state_dir = library / converter.STATE_DIR_NAME
+    markers = state_dir / converter.PUBLISHING_DIR_NAME
+    markers.mkdir(parents=True)
+    store = state()
+    store.set_meta("last_modified", "2999-01-01 00:00:00+00:00")  # nothing is new to an incremental run
+    store.commit()
+
+    # The killed run published one EPUB without registering it, and was converting another book
+    epub = published.formats["mobi"][:-len("mobi")] + "epub"
+    shutil.copyfile(published.formats["mobi"], epub)
+    marker = markers / f"{published.id}.epub.json"
+    marker.write_text(json.dumps({"book": published.id, "format": "epub", "temp": epub + ".tmp", "path": epub}))
+    job = converter.Job(published, "mobi", converter.source_signature(published.formats["mobi"]),
+                        outputs={"epub": epub})
+    journal = converter.Journal.open(str(state_dir))
+    journal.append("planned", books=[published.id, converting.id])
+    journal.converted(job)
+    journal.append("converting", book=converting.id)
+    journal.close()
+
+    convert()
+
+    assert "epub" in formats(library)[published.id]
+    assert "epub" in formats(library)[converting.id]
+    assert ebook_converts(calibre) == 1  # the published EPUB was registered, not converted again
+    assert not marker.exists()
+    assert (state_dir / converter.JOURNAL_NAME).read_text() == ""
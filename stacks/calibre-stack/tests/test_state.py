@@ -0,0 +1,37 @@
+"""The state store makes runs incremental, and failed books wait for their retry or a new source"""
+
+import os
+import time
+
+import converter
+from conftest import ebook_converts, formats, mobi_books, needing
+
+def test_unchanged_library_is_not_converted_again(library, convert, state, calibre):
+    to_convert = needing(library)
+    converted, skipped, errors = convert()
+    assert (converted, errors) == (len(to_convert), 0)
+    assert state().get_meta("last_modified")
+    calls = ebook_converts(calibre)
+
+    assert convert()[0] == 0
+    assert ebook_converts(calibre) == calls
+
+def test_failed_book_waits_until_its_source_changes(library, convert, state):
+    book, = mobi_books(library, 1)
+    source = book.formats["mobi"]
+    store = state()
+    store.record(book.id, "failed", "mobi", converter.source_signature(source), "boom", attempts=1,
+                 next_attempt=time.time() + 3600)
+    store.commit()
+
+    convert("--full")
+    assert "epub" not in formats(library)[book.id]
+    assert store.get(book.id)[0] == "failed"
+
+    # A replaced source file is a new book as far as retries go
+    with open(source, "ab") as f:
+        f.write(b"fixed")
+    os.utime(source, (time.time() + 5, time.time() + 5))
+    convert("--full")
+    assert "epub" in formats(library)[book.id]
+    assert state().get(book.id)[0] == "converted"
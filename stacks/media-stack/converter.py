@@ -0,0 +1 @@
+../calibre-stack/converter.py
\ No newline at end of file